@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+
+import os, sys, io, argparse, textwrap, json, re, random, timeit, time, resource, tempfile, shutil, subprocess, filecmp
+import concurrent.futures, multiprocessing
+
+import ldd2bh, gen_dump
+
+# The serialization path used before User/Computer/Group/Domain grew to_dict(),
+# kept here so the two can be compared side by side.
+legacy_bracket_newline = re.compile(r'^((\s*)".*?":)\s*([\[])', re.MULTILINE)
+
+def legacy_python_to_json(j):
+	return j.replace("True", "true").replace("False", "false").replace("None", "null")
+
+def legacy_export_user(u):
+	buf = '{' + '"AllowedToDelegate": {}, "ObjectIdentifier": "{}", "PrimaryGroupSid": "{}", "Properties": {}, "Aces": {}, "SPNTargets": {}, "HasSIDHistory": {}'.format(
+		u.AllowedToDelegate,
+		u.ObjectIdentifier,
+		u.PrimaryGroupSid,
+		json.dumps(u.properties, indent=4, separators=(",", ": "), sort_keys=False),
+		u.Aces,
+		u.SPNTargets,
+		u.HasSIDHistory
+		) + '}'
+	return legacy_python_to_json(json.loads(json.dumps(buf, indent=4, sort_keys=False, separators=(",", ": "))))
+
+def legacy_serialize_user(u):
+	# export() followed by this object's share of the whole-file
+	# json.loads/json.dumps/regex pass that parse_users used to run
+	buf = json.dumps(json.loads(legacy_export_user(u)), indent=4, sort_keys=False, separators=(",", ": "))
+	return legacy_bracket_newline.sub(r"\1\n\2\3", legacy_bracket_newline.sub(r"\1\n\2\3", buf))
+
+def sample_user():
+	u = ldd2bh.User()
+	u.ObjectIdentifier = "S-1-5-21-1004336348-1177238915-682003330-1105"
+	u.PrimaryGroupSid = "S-1-5-21-1004336348-1177238915-682003330-513"
+	u.properties.update({
+		"name": "JDOE@CORP.LOCAL",
+		"domain": "CORP.LOCAL",
+		"objectid": u.ObjectIdentifier,
+		"distinguishedname": "CN=John Doe,OU=Staff,DC=corp,DC=local",
+		"highvalue": False,
+		"unconstraineddelegation": False,
+		"passwordnotreqd": False,
+		"enabled": True,
+		"lastlogon": 1632979689,
+		"lastlogontimestamp": 1632979689,
+		"pwdlastset": 1630646882,
+		"dontreqpreauth": False,
+		"pwdneverexpires": True,
+		"sensitive": False,
+		"serviceprincipalnames": ["HTTP/web01.corp.local"],
+		"hasspn": True,
+		"displayname": "John Doe",
+		"description": "Web service account",
+		"admincount": False
+	})
+	return u
+
+def bench_serialize(number):
+	u = sample_user()
+	results = {}
+	results["legacy"] = min(timeit.repeat(lambda: legacy_serialize_user(u), number=number, repeat=3)) / number
+	results["to_dict"] = min(timeit.repeat(lambda: ldd2bh.pretty_json(u.to_dict(), 2), number=number, repeat=3)) / number
+	print("Per-object User serialization ({} objects):".format(number))
+	for name, t in results.items():
+		print("  {:<10} {:8.2f} us/object".format(name, t * 1e6))
+	print("  speedup    {:8.2f}x".format(results["legacy"] / results["to_dict"]))
+
+def legacy_uac(uac):
+	# the per-object check() calls build_user made before decode_uac
+	flags = ldd2bh.user_access_control
+	return {
+		"unconstraineddelegation": ldd2bh.check(uac, flags["TRUSTED_FOR_DELEGATION"]),
+		"passwordnotreqd": ldd2bh.check(uac, flags["PASSWD_NOTREQD"]),
+		"enabled": not ldd2bh.check(uac, flags["ACCOUNTDISABLE"]),
+		"dontreqpreauth": ldd2bh.check(uac, flags["DONT_REQ_PREAUTH"]),
+		"pwdneverexpires": ldd2bh.check(uac, flags["DONT_EXPIRE_PASSWORD"]),
+		"sensitive": ldd2bh.check(uac, flags["NOT_DELEGATED"])
+	}
+
+def bench_uac(number):
+	generator = gen_dump.Generator(number)
+	users = [generator.user(i) for i in range(number)]
+	def legacy():
+		for user in users:
+			legacy_uac(user['attributes']['userAccountControl'][0])
+	def cached():
+		for user in users:
+			ldd2bh.object_uac(user)
+	results = {}
+	results["check"] = min(timeit.repeat(legacy, number=1, repeat=3)) / number
+	results["cached"] = min(timeit.repeat(cached, number=1, repeat=3)) / number
+	print("Per-object userAccountControl decoding ({} objects):".format(number))
+	for name, t in results.items():
+		print("  {:<10} {:8.2f} us/object".format(name, t * 1e6))
+	print("  speedup    {:8.2f}x".format(results["check"] / results["cached"]))
+
+stages = ["users", "computers", "groups", "domains", "trusts"]
+stage_inputs = { "users": "users", "computers": "computers", "groups": "groups", "domains": "policy", "trusts": "trusts" }
+
+def time_stage(stage, input_folder, output_folder):
+	# Runs in a fresh process so the peak RSS belongs to this stage alone.
+	# groups runs without the users stage before it, so it includes building
+	# the DN index from domain_users.json, and trusts reads the domains.json
+	# written by the domains stage.
+	baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+	start = time.perf_counter()
+	if (stage == "users"):
+		ldd2bh.parse_users(input_folder, output_folder, 3)
+	elif (stage == "computers"):
+		ldd2bh.parse_computers(input_folder, output_folder, 3)
+	elif (stage == "groups"):
+		ldd2bh.parse_groups(input_folder, output_folder, True, 3)
+	elif (stage == "domains"):
+		ldd2bh.parse_domains(input_folder, output_folder, 3)
+	elif (stage == "trusts"):
+		ldd2bh.parse_domain_trusts(input_folder, output_folder, 3)
+	elapsed = time.perf_counter() - start
+	return elapsed, baseline, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def bench_stages(input_folder):
+	output_folder = tempfile.mkdtemp(prefix="ldd2bh_bench_")
+	context = multiprocessing.get_context("spawn")
+	print("Stages on {}:".format(input_folder))
+	print("  {:<10} {:>9} {:>10} {:>14} {:>12}".format("stage", "objects", "seconds", "objects/s", "peak MB"))
+	try:
+		for stage in stages:
+			count = sum(1 for _ in ldd2bh.iter_json_array(os.path.join(input_folder, "domain_" + stage_inputs[stage] + ".json")))
+			with concurrent.futures.ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+				elapsed, baseline, peak = pool.submit(time_stage, stage, input_folder, output_folder).result()
+			# ru_maxrss is in KB on Linux
+			print("  {:<10} {:>9} {:>10.3f} {:>14.0f} {:>12.1f}".format(stage, count, elapsed, count / elapsed if elapsed else 0, peak / 1024))
+		print("  (peak MB includes about {:.1f} MB for the interpreter)".format(baseline / 1024))
+	finally:
+		shutil.rmtree(output_folder)
+
+backend_modes = { "pretty": [], "compact": ["--compact"], "neo4j": ["--neo4j"] }
+
+def installed_backends():
+	# json first, the others are compared against it
+	return ["json"] + [name for name in ldd2bh.json_backends if name != "json" and getattr(ldd2bh, name) is not None]
+
+def bench_backends(input_folder):
+	# Converts input_folder with every installed JSON backend and checks
+	# that each writes exactly the same files as the stdlib json module
+	output_folder = tempfile.mkdtemp(prefix="ldd2bh_bench_")
+	script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "ldd2bh.py")
+	backends = installed_backends()
+	mismatches = 0
+	print("JSON backends on {}:".format(input_folder))
+	print("  {:<10} {:<10} {:>10}  {}".format("backend", "output", "seconds", "same as json"))
+	for backend in backends:
+		if (ldd2bh.choose_json_backend(backend).name != backend):
+			print("  {:<10} fails its self-check, ldd2bh would use json instead".format(backend))
+			mismatches += 1
+	try:
+		for mode, flags in backend_modes.items():
+			for backend in backends:
+				path = os.path.join(output_folder, mode, backend)
+				os.makedirs(path)
+				start = time.perf_counter()
+				subprocess.run([sys.executable, script, "-i", input_folder, "-o", path, "--json-backend", backend] + flags, check=True, stdout=subprocess.DEVNULL)
+				elapsed = time.perf_counter() - start
+				reference = os.path.join(output_folder, mode, "json")
+				names = sorted(os.listdir(reference))
+				same = sorted(os.listdir(path)) == names and filecmp.cmpfiles(reference, path, names, shallow=False)[0] == names
+				mismatches += not same
+				print("  {:<10} {:<10} {:>10.3f}  {}".format(backend, mode, elapsed, "yes" if same else "NO"))
+	finally:
+		shutil.rmtree(output_folder)
+	return mismatches
+
+edge_strings = ["", "plain", "caf\u00e9", "\u4e2d", "\U0001f600", "\ud800", "\x7f", "\x01", "\u2028", "\"", "\\", "/", "\n\t", "}, {", "}]", "<&>"]
+edge_numbers = [0, -1, 2 ** 63 - 1, 2 ** 63, 2 ** 64 - 1, 2 ** 64, -2 ** 63, -2 ** 63 - 1, -479526344351081010283, 10 ** 30, 0.1, -1e-07, 1.5e+300, True, False, None]
+
+def edge_value(rng, depth):
+	pick = rng.random()
+	if (depth < 3 and pick < 0.2):
+		return [edge_value(rng, depth + 1) for _ in range(rng.randint(0, 4))]
+	if (depth < 3 and pick < 0.35):
+		return { edge_string(rng): edge_value(rng, depth + 1) for _ in range(rng.randint(0, 4)) }
+	if (pick < 0.5):
+		return { "encoded": edge_string(rng), "encoding": "base64" }
+	if (pick < 0.75):
+		return rng.choice(edge_numbers)
+	return edge_string(rng)
+
+def edge_string(rng):
+	return "".join(rng.choice(edge_strings) for _ in range(rng.randint(0, 6)))
+
+def edge_records(number):
+	# ldapdomaindump-like records full of what the backends handle differently
+	# from json: escapes, non-ASCII, DEL, control characters, lone surrogates,
+	# integers past 64 bits and element ends inside strings
+	rng = random.Random(1)
+	return [{ "attributes": { edge_string(rng): [edge_value(rng, 1) for _ in range(rng.randint(1, 4))] for _ in range(rng.randint(0, 8)) }, "dn": edge_string(rng) } for _ in range(number)]
+
+def check_backend_edges(number=2000):
+	# compact(), pretty() and iter_json_file() of every installed backend on
+	# edge_records(), compared with json
+	records = edge_records(number)
+	reference = ldd2bh.JsonBackend()
+	expected = reference.compact(records)
+	# as json and raw UTF-8, where lone surrogates can only be escaped
+	inputs = [json.dumps(records, ensure_ascii=ascii, indent=indent).replace("\ud800", "\\ud800").encode() for ascii in (True, False) for indent in (None, 2)]
+	previous = ldd2bh.json_backend.name
+	mismatches = 0
+	print("JSON backends on {} edge case records:".format(number))
+	try:
+		for backend in installed_backends():
+			ldd2bh.use_json_backend(backend)
+			failed = [] if ldd2bh.json_backend.name == backend else ["self-check"]
+			if (any(ldd2bh.json_backend.compact(record) != reference.compact(record) for record in records)):
+				failed.append("compact")
+			if (any(ldd2bh.json_backend.pretty(record) != reference.pretty(record) for record in records)):
+				failed.append("pretty")
+			if (any(reference.compact(ldd2bh.json_backend.loads(reference.compact(record))) != reference.compact(record) for record in records)):
+				failed.append("loads")
+			for data in inputs:
+				for chunk_size in (7, 64, 4096, 1 << 20):
+					if (reference.compact(list(ldd2bh.iter_json_file(io.BytesIO(data), chunk_size=chunk_size))) != expected):
+						failed.append("read {} byte chunks".format(chunk_size))
+			mismatches += bool(failed)
+			print("  {:<10} {}".format(backend, ", ".join(sorted(set(failed))) if failed else "same as json"))
+	finally:
+		ldd2bh.use_json_backend(previous)
+	return mismatches
+
+def with_input(args, run):
+	if (args.input_folder):
+		return run(args.input_folder)
+	input_folder = tempfile.mkdtemp(prefix="ldd2bh_dump_")
+	try:
+		print("Generating {} users...".format(args.scale))
+		gen_dump.generate(input_folder, gen_dump.scale(args.scale))
+		return run(input_folder)
+	finally:
+		shutil.rmtree(input_folder)
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(
+			formatter_class=argparse.RawDescriptionHelpFormatter,
+			description='Benchmarks for ldd2bh',
+			epilog=textwrap.dedent('''Examples:\npython3 bench.py -n 20000\npython3 bench.py --stages -s 100k\npython3 bench.py --stages -i ldd\npython3 bench.py --check-backends -s 100k''')
+	)
+
+	parser.add_argument('-n','--number', dest="number", default=10000, type=int, required=False, help='Objects per timing run, default: 10000')
+	parser.add_argument('--stages', action='store_true', default=False, required=False, help='Time every conversion stage and report throughput and peak memory, default: False')
+	parser.add_argument('--check-backends', dest="check_backends", action='store_true', default=False, required=False, help='Convert with every installed JSON backend, time them and check they all write the same output as json, default: False')
+	parser.add_argument('-i','--input', dest="input_folder", default=None, required=False, help='With --stages or --check-backends, the ldapdomaindump data to convert, default: generate one')
+	parser.add_argument('-s','--scale', dest="scale", default="1k", required=False, help='With --stages or --check-backends and no input, number of users to generate: 1k, 100k, 1M or any number, default: 1k')
+
+	args = parser.parse_args()
+
+	if (args.check_backends):
+		if (check_backend_edges() + with_input(args, bench_backends)):
+			sys.exit(1)
+	elif (args.stages):
+		with_input(args, bench_stages)
+	else:
+		bench_serialize(args.number)
+		bench_uac(args.number)
@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+
+import os, argparse, textwrap, json, base64, struct, random
+from datetime import datetime, timedelta, timezone
+
+# Generates a synthetic ldapdomaindump of a given size to benchmark ldd2bh
+# against. Objects are written one at a time so even the 1M scale only ever
+# holds a single object in memory.
+
+scales = { "1k": 1000, "100k": 100000, "1M": 1000000 }
+
+domain_name = "corp.local"
+domain_dn = "DC=corp,DC=local"
+domain_sid = "S-1-5-21-3623811015-3361044348-30300820"
+
+trusted_domains = [
+	# name, sid, trustDirection, trustType, trustAttributes
+	("child.corp.local", "S-1-5-21-1004336348-1177238915-682003330", 3, 2, 32),
+	("partner.local", "S-1-5-21-2052111302-1418255238-1417001333", 2, 2, 8),
+	("legacy.local", "S-1-5-21-1343024091-725345543-1644491937", 1, 1, 4),
+]
+
+user_uac = [512, 512, 512, 512, 514, 66048, 66048, 4194816, 544, 524800, 1049088]
+computer_uac = [4096, 4096, 4096, 4098, 528384, 532480, 16781312]
+operating_systems = ["Windows 10 Enterprise", "Windows 11 Enterprise", "Windows Server 2016 Standard", "Windows Server 2019 Standard", "Windows Server 2022 Datacenter"]
+spn_services = ["HTTP", "MSSQLSvc", "CIFS", "HOST", "exchangeMDB", "ldap"]
+
+def scale(value):
+	if (value in scales):
+		return scales[value]
+	return int(value)
+
+def sid_bytes(sid):
+	parts = sid.split("-")
+	sub_authorities = [int(x) for x in parts[3:]]
+	return bytes([int(parts[1]), len(sub_authorities)]) + int(parts[2]).to_bytes(6, "big") + b"".join(struct.pack("<I", x) for x in sub_authorities)
+
+class ArrayWriter:
+
+	# Writes a top-level json array one element at a time, laid out like
+	# ldapdomaindump does
+	def __init__(self, path):
+		self.outfile = open(path, "w")
+		self.count = 0
+		self.outfile.write("[")
+
+	def write(self, obj):
+		if (self.count > 0):
+			self.outfile.write(", ")
+		self.outfile.write(json.dumps(obj))
+		self.count += 1
+
+	def close(self):
+		self.outfile.write("]")
+		self.outfile.close()
+
+class Generator:
+
+	def __init__(self, users, seed=1):
+		self.users = users
+		self.computers = max(1, users // 2)
+		self.groups = max(8, users // 20)
+		self.rand = random.Random(seed)
+		self.now = datetime(2023, 6, 1, tzinfo=timezone.utc)
+
+	def timestamp(self, never=0.0):
+		# ldapdomaindump writes never set dates as the FILETIME epoch
+		if (self.rand.random() < never):
+			return "1601-01-01 00:00:00+00:00"
+		ts = self.now - timedelta(seconds=self.rand.randrange(0, 3 * 365 * 86400), microseconds=self.rand.randrange(0, 1000000))
+		return str(ts)
+
+	def user_dn(self, i):
+		return "CN=User {},OU=Staff,{}".format(i, domain_dn)
+
+	def computer_dn(self, i):
+		return "CN=PC{},OU=Workstations,{}".format(i, domain_dn)
+
+	def group_dn(self, i):
+		return "CN=Group {},OU=Groups,{}".format(i, domain_dn)
+
+	def group_rid(self, i):
+		# the first groups are the well known ones
+		return [512, 513, 515, 516, 519, 544, 548, 551][i] if i < 8 else 10000 + i
+
+	def group_sid(self, i):
+		rid = self.group_rid(i)
+		if (rid in (544, 548, 551)):
+			return "S-1-5-32-{}".format(rid)
+		return "{}-{}".format(domain_sid, rid)
+
+	def group_of_user(self, i):
+		return 8 + i % (self.groups - 8) if self.groups > 8 else 1
+
+	def parent_group(self, i):
+		# groups form a tree four wide, so membership nests several levels deep
+		return 8 + (i - 8 - 1) // 4 if i > 8 else None
+
+	def user(self, i):
+		name = "user{}".format(i)
+		dn = self.user_dn(i)
+		a = {
+			"objectClass": ["top", "person", "organizationalPerson", "user"],
+			"cn": ["User {}".format(i)],
+			"distinguishedName": [dn],
+			"sAMAccountName": [name],
+			"objectSid": ["{}-{}".format(domain_sid, 1100 + i)],
+			"primaryGroupID": [512 if i % 50 == 0 else 513],
+			"userAccountControl": [self.rand.choice(user_uac)],
+			"whenCreated": [self.timestamp()],
+			"whenChanged": [self.timestamp()],
+			"uSNChanged": [10000 + i],
+			"pwdLastSet": [self.timestamp(0.02)],
+			"memberOf": [self.group_dn(self.group_of_user(i))],
+		}
+		if (self.rand.random() < 0.9):
+			a["userPrincipalName"] = ["{}@{}".format(name, domain_name)]
+			a["displayName"] = ["User {}".format(i)]
+		if (self.rand.random() < 0.8):
+			a["lastLogon"] = [self.timestamp(0.1)]
+			a["lastLogonTimestamp"] = [self.timestamp(0.1)]
+		if (self.rand.random() < 0.3):
+			a["description"] = ["Account for \"team\" {}".format(i % 97)]
+		if (self.rand.random() < 0.05):
+			a["servicePrincipalName"] = ["{}/svc{}.{}".format(self.rand.choice(spn_services), i, domain_name) for _ in range(self.rand.randint(1, 3))]
+		if (i % 50 == 0):
+			a["adminCount"] = [1]
+		return { "attributes": a, "dn": dn }
+
+	def computer(self, i):
+		name = "PC{}".format(i)
+		dn = self.computer_dn(i)
+		a = {
+			"objectClass": ["top", "person", "organizationalPerson", "user", "computer"],
+			"cn": [name],
+			"distinguishedName": [dn],
+			"sAMAccountName": [name + "$"],
+			"objectSid": ["{}-{}".format(domain_sid, 1100 + self.users + i)],
+			"primaryGroupID": [516 if i < 3 else 515],
+			"userAccountControl": [self.rand.choice(computer_uac)],
+			"whenChanged": [self.timestamp()],
+			"uSNChanged": [10000 + self.users + i],
+			"pwdLastSet": [self.timestamp(0.02)],
+			"dNSHostName": ["{}.{}".format(name.lower(), domain_name)],
+			"operatingSystem": [self.rand.choice(operating_systems)],
+			"servicePrincipalName": ["HOST/{}".format(name), "HOST/{}.{}".format(name.lower(), domain_name)],
+		}
+		if (self.rand.random() < 0.9):
+			a["lastLogonTimestamp"] = [self.timestamp(0.05)]
+		if (self.rand.random() < 0.1):
+			a["description"] = ["Asset tag {}".format(i * 7919 % 100000)]
+		return { "attributes": a, "dn": dn }
+
+	def group_members(self, i):
+		members = []
+		if (i >= 8):
+			members.extend(self.user_dn(u) for u in range(i - 8, self.users, self.groups - 8))
+			members.extend(self.group_dn(c) for c in range(8 + 4 * (i - 8) + 1, min(8 + 4 * (i - 8) + 5, self.groups)))
+		elif (i == 0):
+			members.extend(self.user_dn(u) for u in range(0, self.users, 50))
+		elif (i == 3):
+			members.extend(self.computer_dn(c) for c in range(min(3, self.computers)))
+		elif (i == 5):
+			members.append(self.group_dn(0))
+			members.append(self.group_dn(4))
+		return members
+
+	def group(self, i):
+		dn = self.group_dn(i)
+		a = {
+			"objectClass": ["top", "group"],
+			"cn": ["Group {}".format(i)],
+			"distinguishedName": [dn],
+			"sAMAccountName": ["group{}".format(i)],
+			"objectSid": [self.group_sid(i)],
+			"whenChanged": [self.timestamp()],
+			"uSNChanged": [10000 + self.users + self.computers + i],
+		}
+		members = self.group_members(i)
+		if (members):
+			a["member"] = members
+		parent = self.parent_group(i)
+		if (parent is not None):
+			a["memberOf"] = [self.group_dn(parent)]
+		if (i < 8):
+			a["adminCount"] = [1]
+		if (self.rand.random() < 0.5):
+			a["description"] = ["Group {} of the {} department".format(i, i % 13)]
+		return { "attributes": a, "dn": dn }
+
+	def policy(self):
+		a = {
+			"objectClass": ["top", "domain", "domainDNS"],
+			"distinguishedName": [domain_dn],
+			"objectSid": [domain_sid],
+			"msDS-Behavior-Version": [7],
+			"description": ["Synthetic domain"],
+			"whenChanged": [self.timestamp()],
+		}
+		return { "attributes": a, "dn": domain_dn }
+
+	def trust(self, name, sid, direction, trust_type, attributes):
+		dn = "CN={},CN=System,{}".format(name, domain_dn)
+		a = {
+			"objectClass": ["top", "leaf", "trustedDomain"],
+			"cn": [name],
+			"name": [name],
+			"distinguishedName": [dn],
+			"trustPartner": [name],
+			"trustDirection": [direction],
+			"trustType": [trust_type],
+			"trustAttributes": [attributes],
+			"securityIdentifier": [{ "encoded": base64.b64encode(sid_bytes(sid)).decode(), "encoding": "base64" }],
+		}
+		return { "attributes": a, "dn": dn }
+
+	def write(self, output_folder):
+		os.makedirs(output_folder, exist_ok=True)
+		def path(name):
+			return os.path.join(output_folder, "domain_" + name + ".json")
+		outfile = ArrayWriter(path("users"))
+		for i in range(self.users):
+			outfile.write(self.user(i))
+		outfile.close()
+		outfile = ArrayWriter(path("computers"))
+		for i in range(self.computers):
+			outfile.write(self.computer(i))
+		outfile.close()
+		outfile = ArrayWriter(path("groups"))
+		for i in range(self.groups):
+			outfile.write(self.group(i))
+		outfile.close()
+		outfile = ArrayWriter(path("policy"))
+		outfile.write(self.policy())
+		outfile.close()
+		outfile = ArrayWriter(path("trusts"))
+		for trust in trusted_domains:
+			outfile.write(self.trust(*trust))
+		outfile.close()
+
+def generate(output_folder, users, seed=1):
+	Generator(users, seed).write(output_folder)
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(
+			formatter_class=argparse.RawDescriptionHelpFormatter,
+			description='Generate a synthetic ldapdomaindump for benchmarking ldd2bh',
+			epilog=textwrap.dedent('''Examples:\npython3 gen_dump.py -o ldd -s 100k''')
+	)
+
+	parser.add_argument('-o','--output', dest="output_folder", required=True, help='Output Directory for the ldapdomaindump files')
+	parser.add_argument('-s','--scale', dest="scale", default="1k", required=False, help='Number of users: 1k, 100k, 1M or any number, computers and groups scale with it, default: 1k')
+	parser.add_argument('--seed', dest="seed", default=1, type=int, required=False, help='Random seed, default: 1')
+
+	args = parser.parse_args()
+
+	generate(args.output_folder, scale(args.scale), args.seed)
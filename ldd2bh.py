@@ -1,13 +1,42 @@
 #!/usr/bin/env python3
 
-import os, sys, uuid, argparse, textwrap, glob, json, base64, re
+import os, sys, uuid, argparse, textwrap, glob, json, base64, re, codecs, shutil, hashlib, sqlite3, csv
+import concurrent.futures, functools, itertools, gzip, zipfile, io, time, contextlib, cProfile, pstats, struct
 from datetime import datetime
-from binascii import b2a_hex
+
+try:
+	import resource
+except ImportError:
+	resource = None
+
+try:
+	import orjson
+except ImportError:
+	orjson = None
+
+try:
+	import ujson
+except ImportError:
+	ujson = None
 
 hvt = ["512", "516", "519", "520"]
 
 db = {}
 
+# domain name -> SID, filled by parse_domains for the trusts
+domain_sids = {}
+
+# Interned SID strings shared by every object: domain SID prefixes, and
+# (domain SID, RID) -> SID for the well known RIDs used as primary groups
+# and local admins. Both only grow with the number of domains.
+domain_prefixes = {}
+rid_sids = {}
+
+# Per input ("users", "computers"): group SID -> the [SID, type] of every
+# member whose primaryGroupID is that group, which isn't in the member
+# attribute of the group. Built while the users and computers are read.
+primary_members = {}
+
 # https://docs.microsoft.com/en-us/troubleshoot/windows-server/identity/useraccountcontrol-manipulate-account-properties
 user_access_control = {
 	"SCRIPT": 0x0001,
@@ -34,6 +63,25 @@ user_access_control = {
 	"PARTIAL_SECRETS_ACCOUNT": 0x04000000
 }
 
+# flag names ldapdomaindump uses in the .grep files that differ from the above
+uac_aliases = {
+	"ACCOUNT_DISABLED": "ACCOUNTDISABLE",
+	"ACCOUNT_LOCKED": "LOCKOUT",
+	"DONT_EXPIRE_PASSWD": "DONT_EXPIRE_PASSWORD",
+	"PASSWORD_STORE_CLEARTEXT": "ENCRYPTED_TEXT_PWD_ALLOWED",
+	"WORKSTATION_ACCOUNT": "WORKSTATION_TRUST_ACCOUNT"
+}
+
+# Bloodhound property -> (userAccountControl flag, property value when the flag is set)
+uac_properties = {
+	"enabled": ("ACCOUNTDISABLE", False),
+	"unconstraineddelegation": ("TRUSTED_FOR_DELEGATION", True),
+	"passwordnotreqd": ("PASSWD_NOTREQD", True),
+	"dontreqpreauth": ("DONT_REQ_PREAUTH", True),
+	"pwdneverexpires": ("DONT_EXPIRE_PASSWORD", True),
+	"sensitive": ("NOT_DELEGATED", True)
+}
+
 # https://github.com/fox-it/BloodHound.py/blob/6b83660d3b5adedc24e5b2c2d142c524e320ad1c/bloodhound/ad/utils.py#L101
 # I really didn't want to just copy paste this but this is the best way I can think of doing it so props to @dirkjanm
 functional_level = {
@@ -68,11 +116,956 @@ def ret_os_path():
 	else:
 		return "/"
 
-def python_to_json(j):
-	return j.replace("True", "true").replace("False", "false").replace("None", "null")
+class Stats:
+
+	# Per-stage instrumentation for --stats. Reading (including json decoding)
+	# and writing are timed around the input iterator and the output writer,
+	# converting is whatever is left of the stage's wall time. Does nothing
+	# unless enabled.
+	def __init__(self):
+		self.enabled = False
+		self.profile = None
+		self.profile_folder = "."
+		self.stages = []
+		self.current = None
+
+	@contextlib.contextmanager
+	def stage(self, name, paths, bytes_read=None):
+		if (not self.enabled and self.profile != name):
+			yield
+			return
+		if (bytes_read is None):
+			bytes_read = sum(os.path.getsize(path) for path in paths if os.path.exists(path))
+		self.current = { "stage": name, "seconds": 0.0, "read_seconds": 0.0, "convert_seconds": 0.0, "write_seconds": 0.0,
+			"objects": 0, "objects_per_second": 0.0, "bytes_read": bytes_read,
+			"bytes_written": 0, "peak_rss_mb": None }
+		profiler = None
+		if (self.profile == name):
+			profiler = cProfile.Profile()
+			profiler.enable()
+		peak_reset = self.reset_peak_rss()
+		start_maxrss = None if resource is None else resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+		start = time.perf_counter()
+		try:
+			yield
+		finally:
+			elapsed = time.perf_counter() - start
+			if (profiler is not None):
+				profiler.disable()
+				self.write_profile(name, profiler)
+			stage = self.current
+			self.current = None
+			stage["seconds"] = elapsed
+			stage["convert_seconds"] = max(0.0, elapsed - stage["read_seconds"] - stage["write_seconds"])
+			if (elapsed > 0):
+				stage["objects_per_second"] = stage["objects"] / elapsed
+			stage["peak_rss_mb"] = self.peak_rss_mb(peak_reset, start_maxrss)
+			if (self.enabled):
+				self.stages.append(stage)
+
+	def reset_peak_rss(self):
+		# restarts VmHWM, the peak RSS of the process, from the current RSS
+		try:
+			with open("/proc/self/clear_refs", "w") as clear_refs:
+				clear_refs.write("5")
+			return True
+		except OSError:
+			return False
+
+	def peak_rss_mb(self, peak_reset, start_maxrss):
+		# the peak RSS since the stage started, when it can be told apart
+		# from the peak of the earlier stages
+		if (peak_reset):
+			try:
+				with open("/proc/self/status") as status:
+					for line in status:
+						if (line.startswith("VmHWM:")):
+							return int(line.split()[1]) / 1024
+			except (OSError, ValueError):
+				pass
+		if (start_maxrss is not None):
+			# ru_maxrss is the peak of the whole process, in KB on Linux, so
+			# it only belongs to this stage if the stage raised it
+			maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+			if (maxrss > start_maxrss):
+				return maxrss / 1024
+		return None
+
+	def write_profile(self, name, profiler):
+		path = self.profile_folder + ret_os_path() + "ldd2bh_{}.prof".format(name)
+		profiler.dump_stats(path)
+		print("Profile of the {} stage written to {}".format(name, path))
+		pstats.Stats(profiler).sort_stats("cumulative").print_stats(25)
+
+	def reading(self, iterable):
+		if (self.current is None):
+			return iterable
+		return self.timed_reads(iterable, self.current)
+
+	def timed_reads(self, iterable, stage):
+		iterator = iter(iterable)
+		while True:
+			start = time.perf_counter()
+			try:
+				item = next(iterator)
+			except StopIteration:
+				stage["read_seconds"] += time.perf_counter() - start
+				return
+			stage["read_seconds"] += time.perf_counter() - start
+			yield item
+
+	def writer(self, outfile):
+		if (self.current is None):
+			return outfile
+		return TimedWriter(outfile, self.current)
+
+	def summary(self):
+		print("{:<20} {:>9} {:>9} {:>9} {:>9} {:>9} {:>11} {:>9} {:>9} {:>8}".format("stage", "objects", "seconds", "read", "convert", "write", "objects/s", "MB in", "MB out", "peak MB"))
+		for stage in self.stages:
+			print("{:<20} {:>9} {:>9.2f} {:>9.2f} {:>9.2f} {:>9.2f} {:>11.0f} {:>9.1f} {:>9.1f} {:>8}".format(
+				stage["stage"], stage["objects"], stage["seconds"], stage["read_seconds"], stage["convert_seconds"], stage["write_seconds"],
+				stage["objects_per_second"], stage["bytes_read"] / 1048576, stage["bytes_written"] / 1048576,
+				"-" if stage["peak_rss_mb"] is None else "{:.1f}".format(stage["peak_rss_mb"])))
+
+	def save(self, path):
+		with open(path, "w") as outfile:
+			json.dump({ "stages": self.stages }, outfile, indent=4)
+
+	def settings(self):
+		# handed to worker processes, which send their stages back
+		return (self.enabled, self.profile, self.profile_folder)
+
+	def configure(self, settings):
+		self.enabled, self.profile, self.profile_folder = settings
+		self.stages = []
+
+class TimedWriter:
+
+	# Wraps a BloodHoundWriter or ShardedWriter to time the writes for Stats
+	def __init__(self, outfile, stage):
+		self.outfile = outfile
+		self.stage = stage
+
+	def __getattr__(self, name):
+		return getattr(self.outfile, name)
+
+	def write(self, obj):
+		self.write_text(self.outfile.render(obj.to_dict()))
+
+	def write_dict(self, obj):
+		self.write_text(self.outfile.render(obj))
+
+	def write_text(self, text):
+		start = time.perf_counter()
+		self.outfile.write_text(text)
+		self.stage["write_seconds"] += time.perf_counter() - start
+		self.stage["bytes_written"] += len(text)
+		self.stage["objects"] += 1
+
+	def append_fragment(self, path, count):
+		start = time.perf_counter()
+		self.outfile.append_fragment(path, count)
+		self.stage["write_seconds"] += time.perf_counter() - start
+		self.stage["bytes_written"] += os.path.getsize(path)
+		self.stage["objects"] += count
+
+	def adopt(self, path, count):
+		start = time.perf_counter()
+		size = os.path.getsize(path)
+		self.outfile.adopt(path, count)
+		self.stage["write_seconds"] += time.perf_counter() - start
+		self.stage["bytes_written"] += size
+		self.stage["objects"] += count
+
+	def close(self):
+		start = time.perf_counter()
+		self.outfile.close()
+		self.stage["write_seconds"] += time.perf_counter() - start
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.close()
+
+stats = Stats()
+
+def instrumented(name, *inputs):
+	# runs a parse_* function as a Stats stage, inputs are the ldapdomaindump
+	# files it reads from input_folder
+	def wrap(func):
+		@functools.wraps(func)
+		def run(input_folder, *args, **kwargs):
+			with stats.stage(name, [input_file(input_folder, path) for path in inputs]):
+				return func(input_folder, *args, **kwargs)
+		return run
+	return wrap
+
+def iter_json_array(path, start=0, end=None, chunk_size=1 << 20):
+	# Incrementally decode the top-level array of an ldapdomaindump file and
+	# yield one element at a time, so only the current object (plus one read
+	# chunk) is held in memory no matter how big the input is. When given a
+	# byte range from find_chunks(), only the elements inside it are yielded.
+	with open(path, "rb") as infile:
+		infile.seek(start)
+		yield from iter_json_file(infile, start, end, chunk_size, path)
+
+def iter_json_file(infile, start=0, end=None, chunk_size=1 << 20, name="<stream>"):
+	# iter_json_array for an open binary or text file object, positioned at
+	# start
+	remaining = None if end is None else end - start
+
+	def read(size):
+		nonlocal remaining
+		if (remaining is not None):
+			size = min(size, remaining)
+		data = infile.read(size)
+		if (remaining is not None):
+			remaining -= len(data)
+		return data, not data
+
+	data, eof = read(chunk_size)
+	if (isinstance(data, bytes) and json_backend.fast_loads):
+		yield from iter_json_bytes(read, data, eof, start > 0, end, chunk_size, name)
+	else:
+		yield from iter_json_text(read, data, eof, start > 0, end, chunk_size, name)
+
+def iter_json_text(read, data, eof, started, end, chunk_size, name):
+	decoder = json.JSONDecoder()
+	utf8 = codecs.getincrementaldecoder("utf-8")()
+
+	def read_text(size):
+		data, eof = read(size)
+		if isinstance(data, str):
+			return data, eof
+		return utf8.decode(data, eof), eof
+
+	buf = data if isinstance(data, str) else utf8.decode(data, eof)
+	pos = 0
+	while True:
+		while pos < len(buf) and buf[pos] in " \t\r\n":
+			pos += 1
+		if pos >= len(buf):
+			if eof:
+				if (end is not None):
+					return
+				raise ValueError("Unexpected end of JSON array in {}".format(name))
+			buf, eof = read_text(chunk_size)
+			pos = 0
+			continue
+		if not started:
+			if buf[pos] != "[":
+				raise ValueError("Expected a JSON array in {}".format(name))
+			started = True
+			pos += 1
+			continue
+		if buf[pos] == "]":
+			return
+		if buf[pos] == ",":
+			pos += 1
+			continue
+		try:
+			obj, obj_end = decoder.raw_decode(buf, pos)
+		except ValueError:
+			obj, obj_end = None, None
+		if obj_end is None or (obj_end >= len(buf) and not eof):
+			# the object straddles the chunk boundary, pull in more data
+			if eof:
+				raise ValueError("Malformed JSON array in {}".format(name))
+			more, eof = read_text(max(chunk_size, len(buf) - pos))
+			buf = buf[pos:] + more
+			pos = 0
+			continue
+		pos = obj_end
+		yield obj
+
+# where an element of the top-level array can end: a closing brace followed
+# by the next element or the end of the array
+element_end = re.compile(rb'\}\s*(?:,\s*\{|\])')
+
+def iter_json_bytes(read, buf, eof, started, end, chunk_size, name):
+	# iter_json_text for binary input and a backend with a fast loads(). An
+	# element is cut off at the first element_end that makes it parse: an end
+	# inside a string or a nested value gives a slice that doesn't, so this
+	# only ever decodes the real element. Ends of nested values are skipped
+	# without decoding by counting braces, which is only off for braces in
+	# strings, so the search stops at the first end where they balance or
+	# after 32 ends. Elements the backend can't decode, or whose end wasn't
+	# found, go through raw_decode on buf decoded once, text, where text_pos
+	# in buf is text_at in text.
+	loads = json_backend.loads
+	decoder = json.JSONDecoder()
+	pos = 0
+	text = None
+	while True:
+		while pos < len(buf) and buf[pos] in b" \t\r\n":
+			pos += 1
+		if pos >= len(buf):
+			if eof:
+				if (end is not None):
+					return
+				raise ValueError("Unexpected end of JSON array in {}".format(name))
+			buf, eof = read(chunk_size)
+			pos = 0
+			text = None
+			continue
+		if not started:
+			if buf[pos] != ord("["):
+				raise ValueError("Expected a JSON array in {}".format(name))
+			started = True
+			pos += 1
+			continue
+		if buf[pos] == ord("]"):
+			return
+		if buf[pos] == ord(","):
+			pos += 1
+			continue
+		obj_end = None
+		depth = 0
+		scanned = pos
+		m = element_end.search(buf, pos)
+		for _ in range(32):
+			if (m is None):
+				break
+			cut = m.start() + 1
+			depth += buf.count(b"{", scanned, cut) - buf.count(b"}", scanned, cut)
+			scanned = cut
+			if (depth == 0):
+				try:
+					obj = loads(buf[pos:cut])
+					obj_end = cut
+				except ValueError:
+					pass
+			if (depth <= 0):
+				break
+			m = element_end.search(buf, cut)
+		if (obj_end is None):
+			if (text is None):
+				text, text_pos, text_at = buf[pos:].decode("utf-8", "surrogateescape"), pos, 0
+			text_at += len(buf[text_pos:pos].decode("utf-8", "surrogateescape"))
+			text_pos = pos
+			try:
+				obj, text_end = decoder.raw_decode(text, text_at)
+				if (text_end < len(text) or eof):
+					obj_end = pos + len(text[text_at:text_end].encode("utf-8", "surrogateescape"))
+			except ValueError:
+				pass
+		if obj_end is None:
+			# the object straddles the chunk boundary, pull in more data
+			if eof:
+				raise ValueError("Malformed JSON array in {}".format(name))
+			more, eof = read(max(chunk_size, len(buf) - pos))
+			buf = buf[pos:] + more
+			pos = 0
+			text = None
+			continue
+		pos = obj_end
+		yield obj
+
+def input_file(input_folder, name):
+	# domain_users.json, or the domain_users.grep ldapdomaindump writes next
+	# to it when there is no json
+	path = input_folder + ret_os_path() + name + ".json"
+	grep = input_folder + ret_os_path() + name + ".grep"
+	if (not os.path.exists(path) and os.path.exists(grep)):
+		return grep
+	return path
+
+# attributes as they are spelled in the json files, .grep headers are matched
+# case insensitively against these
+grep_attributes = { name.lower(): name for name in [
+	"distinguishedName", "objectSid", "objectClass", "cn", "name", "sAMAccountName", "userPrincipalName", "displayName",
+	"description", "memberOf", "member", "primaryGroupID", "userAccountControl", "adminCount", "whenCreated", "whenChanged",
+	"uSNChanged", "lastLogon", "lastLogonTimestamp", "pwdLastSet", "servicePrincipalName", "dNSHostName", "operatingSystem",
+	"operatingSystemVersion", "operatingSystemServicePack", "msDS-Behavior-Version", "securityIdentifier", "trustPartner",
+	"trustAttributes", "trustDirection", "trustType", "flatName", "mail", "title", "homeDirectory", "sIDHistory"
+] }
+grep_dates = set(["lastLogon", "lastLogonTimestamp", "pwdLastSet", "whenCreated", "whenChanged"])
+grep_numeric = set(["adminCount", "uSNChanged", "msDS-Behavior-Version"])
+grep_separator = re.compile(r'(?<!\\), ')
+
+# trustDirection and trustType as ldapdomaindump names them
+trust_directions = { "DISABLED": 0, "INBOUND": 1, "OUTBOUND": 2, "BIDIRECTIONAL": 3 }
+trust_types = { "DOWNLEVEL": 1, "UPLEVEL": 2, "MIT": 3 }
+
+def grep_flags(cell, flags):
+	value = 0
+	for flag in cell.split(", "):
+		value |= flags.get(flag, 0)
+	return value
+
+def grep_date(cell):
+	# ldapdomaindump writes dates with '%x %X' in the C locale, in UTC and
+	# with a two digit year: 09/30/21 05:28:09. 01/01/01 00:00:00 is the
+	# 1601 date of timestamps that were never set, anything it couldn't
+	# format is 0.
+	if (cell == "01/01/01 00:00:00"):
+		return "1601-01-01 00:00:00+00:00"
+	if ((len(cell) != 17) or (cell[2] != "/") or (cell[5] != "/") or (cell[8] != " ") or (not cell[6:8].isdigit())):
+		return None
+	year = int(cell[6:8])
+	year += 1900 if year >= 69 else 2000
+	return "{}-{}-{} {}+00:00".format(year, cell[0:2], cell[3:5], cell[9:17])
+
+def grep_value(name, cell):
+	if (name == "userAccountControl"):
+		if (cell.isdigit()):
+			return [int(cell)]
+		flags = 0
+		for flag in cell.split(", "):
+			flags |= user_access_control.get(uac_aliases.get(flag, flag), 0)
+		return [flags]
+	if (name in grep_dates):
+		date = grep_date(cell)
+		return [date] if date else None
+	if (name == "trustAttributes"):
+		return [int(cell) if cell.isdigit() else grep_flags(cell, trust_flags)]
+	if (name == "trustDirection"):
+		return [int(cell) if cell.isdigit() else grep_flags(cell, trust_directions)]
+	if (name == "trustType"):
+		return [int(cell) if cell.isdigit() else grep_flags(cell, trust_types)]
+	if (name in grep_numeric):
+		try:
+			return [int(cell)]
+		except ValueError:
+			return [cell]
+	if (name == "securityIdentifier" and cell.startswith("S-")):
+		return [{ "encoded": base64.b64encode(str_to_sid(cell)).decode(), "encoding": "base64" }]
+	if (name == "servicePrincipalName"):
+		return cell.split(",")
+	if (name in ("memberOf", "objectClass")):
+		return grep_separator.split(cell)
+	return [cell]
+
+def grep_rows(infile, name="<stream>"):
+	# the rows of a tab separated .grep file as attribute -> cell, without
+	# the empty cells
+	header = infile.readline()
+	if (isinstance(header, bytes)):
+		infile = codecs.getreader("utf-8")(infile)
+		header = header.decode("utf-8")
+	names = [grep_attributes.get(h.strip().lower(), h.strip()) for h in header.rstrip("\r\n").split("\t")]
+	if (not set(names) & set(["objectSid", "distinguishedName", "cn"])):
+		raise ValueError("{} is not an ldapdomaindump .grep file".format(name))
+	for line in infile:
+		line = line.rstrip("\r\n")
+		if (line):
+			yield { attr: cell for attr, cell in zip(names, line.split("\t")) if cell != "" }
+
+def grep_path(input_folder, name):
+	return input_folder + ret_os_path() + name + ".grep"
+
+def dn_escape(value):
+	return re.sub(r'([,+"\\<>;])', r'\\\1', value)
+
+class GrepDump:
+
+	# What the rows of one .grep file need from the rest of the dump. The
+	# .grep files have no distinguishedName apart from the domain's, name
+	# groups by their CN in memberOf and primaryGroupId, and groups have no
+	# member column. Objects get a DN built from their CN in the default
+	# container, which is what memberOf CNs resolve to through db, and the
+	# members of a group are collected from the memberOf of users and groups.
+	def __init__(self, domain_dn, domain_sid=None, group_sids=None, members=None):
+		self.domain_dn = domain_dn
+		self.domain_sid = domain_sid
+		self.group_sids = group_sids or {}
+		self.members = members or {}
+
+	def dn(self, cn, container):
+		return "CN=" + dn_escape(cn) + "," + container + "," + self.domain_dn
+
+	def group_dn(self, cn):
+		sid = self.group_sids.get(cn, "")
+		return self.dn(cn, "CN=Builtin" if sid.startswith("S-1-5-32-") else "CN=Users")
+
+	@classmethod
+	def load(cls, input_folder, members=False):
+		# the domain DN comes from domain_policy, the domain SID and the group
+		# SIDs from domain_groups.grep, the members only for the groups stage
+		policy = input_file(input_folder, "domain_policy")
+		domain_dn = None
+		if (policy.endswith(".grep")):
+			domain_dn = next(grep_file_rows(policy), {}).get("distinguishedName")
+		elif (os.path.exists(policy)):
+			domain_dn = next(iter(read_records(policy)), { "attributes": {} })["attributes"].get("distinguishedName", [None])[0]
+		if (not domain_dn):
+			raise ValueError("{} has no domain_policy with the distinguishedName of the domain, which the .grep files need".format(input_folder))
+		dump = cls(domain_dn)
+		for row in grep_file_rows(grep_path(input_folder, "domain_groups")):
+			dump.group_sids[row.get("cn")] = row.get("objectSid", "")
+		for row in itertools.chain(grep_file_rows(grep_path(input_folder, "domain_groups")), grep_file_rows(grep_path(input_folder, "domain_users"))):
+			if (row.get("objectSid", "").startswith("S-1-5-21-")):
+				dump.domain_sid = domain_sid(row["objectSid"])
+				break
+		if (members):
+			for row in grep_file_rows(grep_path(input_folder, "domain_users")):
+				dump.add_member(row, dump.dn(row.get("cn", ""), "CN=Users"))
+			for row in grep_file_rows(grep_path(input_folder, "domain_groups")):
+				dump.add_member(row, dump.group_dn(row.get("cn", "")))
+		return dump
+
+	def add_member(self, row, dn):
+		for group in grep_separator.split(row.get("memberOf", "")):
+			if (group):
+				self.members.setdefault(group, []).append(dn)
+
+def grep_file_rows(path):
+	# grep_rows of a file, none if it doesn't exist
+	if (not os.path.exists(path)):
+		return
+	with open(path, "r", encoding="utf-8", newline="") as infile:
+		yield from grep_rows(infile, path)
+
+def grep_record(kind, row, dump):
+	# a .grep row of domain_<kind>.grep as the record the json file has
+	attributes = {}
+	for attr, cell in row.items():
+		value = grep_value(attr, cell)
+		if (value is not None):
+			attributes[attr] = value
+	cn = row.get("cn", "")
+	if (kind == "users"):
+		dn = dump.dn(cn, "CN=Users")
+		# the primary group by name, Domain Users when it wasn't found
+		group = row.get("primaryGroupID", "")
+		if (group.isdigit()):
+			attributes["primaryGroupID"] = [int(group)]
+		else:
+			sid = dump.group_sids.get(group)
+			attributes["primaryGroupID"] = [int(sid.rpartition("-")[2]) if sid else 513]
+	elif (kind == "computers"):
+		dn = dump.dn(cn, "CN=Computers")
+		# not in the file, follows from the account type
+		uac = attributes.get("userAccountControl", [0])[0]
+		if (uac & user_access_control["SERVER_TRUST_ACCOUNT"]):
+			attributes["primaryGroupID"] = [516]
+		elif (uac & user_access_control["PARTIAL_SECRETS_ACCOUNT"]):
+			attributes["primaryGroupID"] = [521]
+		else:
+			attributes["primaryGroupID"] = [515]
+	elif (kind == "groups"):
+		dn = dump.group_dn(cn)
+		attributes.pop("memberOf", None)
+		if (cn in dump.members):
+			attributes["member"] = dump.members[cn]
+	elif (kind == "trusts"):
+		# the CN of a trusted domain object is the name of the other domain
+		dn = dump.dn(cn, "CN=System")
+		attributes["name"] = attributes["trustPartner"] = [cn]
+		for attr in ("trustAttributes", "trustDirection", "trustType"):
+			attributes.setdefault(attr, [0])
+	else:
+		dn = attributes.get("distinguishedName", [dump.domain_dn])[0]
+		if (dump.domain_sid is not None):
+			attributes.setdefault("objectSid", [dump.domain_sid])
+	attributes["distinguishedName"] = [dn]
+	return { "attributes": attributes, "dn": dn }
+
+def iter_grep(infile, kind, dump, name="<stream>"):
+	# Records from domain_<kind>.grep, one of the tab separated files
+	# ldapdomaindump writes next to the json: a header row with the
+	# attribute names, then one object per line in a readable form. Streams
+	# line by line without any json decoding, dump is the GrepDump of the
+	# other files.
+	for row in grep_rows(infile, name):
+		yield grep_record(kind, row, dump)
+
+def iter_grep_file(path, dump=None):
+	kind = os.path.basename(path)[len("domain_"):-len(".grep")]
+	if (dump is None):
+		dump = GrepDump.load(os.path.dirname(path) or ".", members=(kind == "groups"))
+	for row in grep_file_rows(path):
+		yield grep_record(kind, row, dump)
+
+def read_records(source):
+	# ldapdomaindump records from a path (.json or .grep), a file object
+	# holding the json array, or any iterable of already decoded records
+	# such as iter_grep() over an open .grep file and its GrepDump
+	if isinstance(source, str):
+		if (source.endswith(".grep")):
+			return stats.reading(iter_grep_file(source))
+		return stats.reading(iter_json_array(source))
+	if hasattr(source, "read"):
+		return stats.reading(iter_json_file(source))
+	return stats.reading(source)
+
+def find_element_start(infile, offset, window=1 << 16):
+	# Find the byte offset of the first top-level array element at or after
+	# `offset`. A candidate '{' has to follow a ',' and decode to a full
+	# ldapdomaindump object that is followed by the next object or the closing
+	# ']', which rules out braces inside strings and nested values.
+	decoder = json.JSONDecoder()
+	while True:
+		infile.seek(offset)
+		data = infile.read(window)
+		eof = len(data) < window
+		grow = False
+		p = data.find(b"{")
+		while p != -1:
+			q = p - 1
+			while q >= 0 and data[q] in b" \t\r\n":
+				q -= 1
+			if (q >= 0 and data[q] == ord(",")):
+				text = data[p:].decode("utf-8", "ignore")
+				try:
+					obj, obj_end = decoder.raw_decode(text)
+					rest = text[obj_end:].lstrip()
+				except ValueError:
+					obj, rest = None, ""
+				if (isinstance(obj, dict) and "attributes" in obj):
+					if (rest[:1] == "]" or (rest[:1] == "," and rest[1:].lstrip()[:1] == "{")):
+						return offset + p
+				if (not rest and not eof):
+					# cut off by the window, look again with a bigger one
+					grow = True
+					break
+			p = data.find(b"{", p + 1)
+		if (eof and not grow):
+			return None
+		window *= 2
+
+def find_chunks(path, parts):
+	# Split the top-level array of `path` into at most `parts` byte ranges
+	# that each start on an element boundary
+	size = os.path.getsize(path)
+	bounds = [0]
+	with open(path, "rb") as infile:
+		for i in range(1, parts):
+			offset = max(size * i // parts, bounds[-1] + 1)
+			boundary = find_element_start(infile, offset)
+			if (boundary is None):
+				break
+			if (boundary > bounds[-1]):
+				bounds.append(boundary)
+	bounds.append(size)
+	return list(zip(bounds[:-1], bounds[1:]))
+
+def fingerprint(path):
+	# cheap identity for an input file: size, mtime and a hash of its head
+	st = os.stat(path)
+	with open(path, "rb") as infile:
+		head = hashlib.sha1(infile.read(1 << 16)).hexdigest()
+	return "{}:{}:{}".format(st.st_size, st.st_mtime_ns, head)
+
+class IndexStore:
+
+	# SQLite file kept next to the Bloodhound output that holds the DN -> SID
+	# entries built from each input file, tagged with the fingerprint of that
+	# file, so a rerun can load them instead of decoding the input again.
+	# For incremental runs it also keeps every converted object by objectSid,
+	# along with the fingerprint of the ldapdomaindump object it came from.
+	filename = "ldd2bh_cache.db"
+
+	def __init__(self, output_folder):
+		self.pending = 0
+		self.shared = (spill is not None) and (spill.folder == os.path.abspath(output_folder))
+		if (self.shared):
+			# --max-memory keeps its scratch tables in this file, and a second
+			# connection would wait on the writes this one has not committed
+			self.conn = spill.conn
+			return
+		# stages may run in separate processes, WAL and a long timeout let
+		# them share the file
+		self.conn = sqlite3.connect(output_folder + ret_os_path() + self.filename, timeout=300)
+		self.conn.execute("PRAGMA journal_mode=WAL")
+		self.conn.execute("CREATE TABLE IF NOT EXISTS sources (name TEXT PRIMARY KEY, fingerprint TEXT)")
+		self.conn.execute("CREATE TABLE IF NOT EXISTS dn_index (source TEXT, dn TEXT, sid TEXT, type TEXT, PRIMARY KEY (source, dn))")
+		self.conn.execute("CREATE TABLE IF NOT EXISTS objects (type TEXT, sid TEXT, fingerprint TEXT, record TEXT, run INTEGER, PRIMARY KEY (type, sid))")
+		if (self.conn.execute("SELECT name FROM sqlite_master WHERE name = 'primary_groups'").fetchone() is None):
+			# indexes saved before the primary groups were kept are rebuilt
+			with self.conn:
+				self.conn.execute("CREATE TABLE IF NOT EXISTS primary_groups (source TEXT, sid TEXT, group_sid TEXT, type TEXT, PRIMARY KEY (source, sid))")
+				self.conn.execute("DELETE FROM sources WHERE name NOT LIKE 'objects:%'")
+
+	def is_current(self, source, fp):
+		row = self.conn.execute("SELECT fingerprint FROM sources WHERE name = ?", (source,)).fetchone()
+		return row is not None and row[0] == fp
+
+	def load(self, source, index):
+		# also loads the primary_members of source
+		for dn, sid, obj_type in self.conn.execute("SELECT dn, sid, type FROM dn_index WHERE source = ?", (source,)):
+			index[dn] = [sid, obj_type]
+		primary = new_primary(source)
+		for sid, group_sid, obj_type in self.conn.execute("SELECT sid, group_sid, type FROM primary_groups WHERE source = ? ORDER BY rowid", (source,)):
+			primary.setdefault(group_sid, []).append([sid, obj_type])
+
+	def save(self, source, fp, index, primary):
+		with self.conn:
+			self.conn.execute("DELETE FROM dn_index WHERE source = ?", (source,))
+			self.conn.executemany("INSERT OR REPLACE INTO dn_index VALUES (?, ?, ?, ?)", ((source, dn, v[0], v[1]) for dn, v in index.items()))
+			self.conn.execute("DELETE FROM primary_groups WHERE source = ?", (source,))
+			self.conn.executemany("INSERT OR REPLACE INTO primary_groups VALUES (?, ?, ?, ?)", ((source, v[0], group_sid, v[1]) for group_sid, members in primary.items() for v in members))
+			self.conn.execute("INSERT OR REPLACE INTO sources VALUES (?, ?)", (source, fp))
+
+	def begin_objects(self, obj_type, converter):
+		# objects converted by a different ldd2bh or for another output
+		# format can't be reused
+		if (not self.is_current("objects:" + obj_type, converter)):
+			with self.conn:
+				self.conn.execute("DELETE FROM objects WHERE type = ?", (obj_type,))
+				self.conn.execute("INSERT OR REPLACE INTO sources VALUES (?, ?)", ("objects:" + obj_type, converter))
+		row = self.conn.execute("SELECT MAX(run) FROM objects WHERE type = ?", (obj_type,)).fetchone()
+		self.run = (row[0] or 0) + 1
+
+	def cached_object(self, obj_type, sid, fp):
+		row = self.conn.execute("SELECT fingerprint, record FROM objects WHERE type = ? AND sid = ?", (obj_type, sid)).fetchone()
+		if (row is None or row[0] != fp):
+			return None
+		self.conn.execute("UPDATE objects SET run = ? WHERE type = ? AND sid = ?", (self.run, obj_type, sid))
+		self.commit_pending()
+		return row[1]
+
+	def save_object(self, obj_type, sid, fp, record):
+		self.conn.execute("INSERT OR REPLACE INTO objects VALUES (?, ?, ?, ?, ?)", (obj_type, sid, fp, record, self.run))
+		self.commit_pending()
+
+	def commit_pending(self):
+		self.pending += 1
+		if (self.pending >= 10000):
+			self.conn.commit()
+			self.pending = 0
+
+	def end_objects(self, obj_type):
+		# everything not seen in this run was deleted from the domain
+		with self.conn:
+			self.conn.execute("DELETE FROM objects WHERE type = ? AND run != ?", (obj_type, self.run))
+
+	def close(self):
+		if (self.shared):
+			self.conn.commit()
+		else:
+			self.conn.close()
+
+class Spill:
+
+	# Memory budget shared by the SpillIndex and SpillGroups of a run. Once
+	# their entries are estimated to take more than max_bytes, all of them
+	# are moved to scratch tables in ldd2bh_cache.db and lookups that miss
+	# memory go to SQLite instead.
+	def __init__(self, output_folder, max_bytes):
+		self.folder = os.path.abspath(output_folder)
+		self.store = IndexStore(output_folder)
+		# the IndexStores of the run use this connection too
+		self.conn = self.store.conn
+		self.conn.execute("PRAGMA synchronous=NORMAL")
+		self.max_bytes = max_bytes
+		self.used = 0
+		self.maps = []
+		self.spills = 0
+
+	def table(self, spill_map, columns):
+		name = "spill_{}".format(len(self.maps))
+		self.conn.execute("DROP TABLE IF EXISTS {}".format(name))
+		self.conn.execute("CREATE TABLE {} ({})".format(name, columns))
+		self.maps.append(spill_map)
+		return name
+
+	def charge(self, size):
+		self.used += size
+		if (self.used > self.max_bytes):
+			with self.conn:
+				for spill_map in self.maps:
+					spill_map.flush()
+			self.used = 0
+			self.spills += 1
+
+	def close(self):
+		with self.conn:
+			for i in range(len(self.maps)):
+				self.conn.execute("DROP TABLE IF EXISTS spill_{}".format(i))
+		self.store.close()
+
+class SpillIndex:
+
+	# DN -> [SID, type] like db, or SID -> [SID, type] like principals, but
+	# only what fits in the Spill budget is kept in memory
+	entry_size = 160
+
+	def __init__(self, spill):
+		self.spill = spill
+		self.conn = spill.conn
+		self.memory = {}
+		self.spilled = 0
+		self.table = spill.table(self, "dn TEXT PRIMARY KEY, sid TEXT, type TEXT")
+
+	def flush(self):
+		self.conn.executemany("INSERT OR REPLACE INTO {} VALUES (?, ?, ?)".format(self.table), ((dn, v[0], v[1]) for dn, v in self.memory.items()))
+		self.spilled += len(self.memory)
+		self.memory = {}
+
+	def __setitem__(self, dn, entry):
+		self.memory[dn] = entry
+		self.spill.charge(self.entry_size + len(dn) + len(entry[0]))
+
+	def get(self, dn, default=None):
+		entry = self.memory.get(dn)
+		if ((entry is None) and self.spilled):
+			row = self.conn.execute("SELECT sid, type FROM {} WHERE dn = ?".format(self.table), (dn,)).fetchone()
+			if (row is not None):
+				return list(row)
+		return default if entry is None else entry
+
+	def __getitem__(self, dn):
+		entry = self.get(dn)
+		if (entry is None):
+			raise KeyError(dn)
+		return entry
+
+	def __contains__(self, dn):
+		return self.get(dn) is not None
+
+	def __delitem__(self, dn):
+		self.memory.pop(dn, None)
+		if (self.spilled):
+			self.conn.execute("DELETE FROM {} WHERE dn = ?".format(self.table), (dn,))
+
+	def __len__(self):
+		return len(self.memory) + self.spilled
+
+	def items(self):
+		# streams the spilled entries. memory is copied first, as adding
+		# entries while iterating may move it to the table.
+		memory = dict(self.memory)
+		if (self.spilled):
+			for dn, sid, obj_type in self.conn.execute("SELECT dn, sid, type FROM {}".format(self.table)):
+				if (dn not in memory):
+					yield dn, [sid, obj_type]
+		yield from memory.items()
+
+	def values(self):
+		for dn, entry in self.items():
+			yield entry
+
+	def update(self, other):
+		for dn, entry in other.items():
+			self[dn] = entry
+
+	def clear(self):
+		self.memory = {}
+		if (self.spilled):
+			with self.conn:
+				self.conn.execute("DELETE FROM {}".format(self.table))
+			self.spilled = 0
+
+class SpillGroups:
+
+	# group SID -> [[SID, type], ...] like primary_members[source], kept in
+	# memory up to the Spill budget
+	entry_size = 120
+
+	def __init__(self, spill):
+		self.spill = spill
+		self.conn = spill.conn
+		self.memory = {}
+		self.spilled = False
+		self.table = spill.table(self, "group_sid TEXT, sid TEXT, type TEXT")
+		self.conn.execute("CREATE INDEX {0}_group ON {0} (group_sid)".format(self.table))
+
+	def flush(self):
+		self.conn.executemany("INSERT INTO {} VALUES (?, ?, ?)".format(self.table), ((group_sid, v[0], v[1]) for group_sid, members in self.memory.items() for v in members))
+		self.spilled = self.spilled or bool(self.memory)
+		self.memory = {}
+
+	def setdefault(self, group_sid, members):
+		# the members still in memory, for appending to
+		self.spill.charge(self.entry_size)
+		return self.memory.setdefault(group_sid, members)
+
+	def get(self, group_sid, default=None):
+		members = self.memory.get(group_sid, [])
+		if (self.spilled):
+			members = [list(row) for row in self.conn.execute("SELECT sid, type FROM {} WHERE group_sid = ? ORDER BY rowid".format(self.table), (group_sid,))] + members
+		return members or default
+
+	def clear(self):
+		self.memory = {}
+		if (self.spilled):
+			with self.conn:
+				self.conn.execute("DELETE FROM {}".format(self.table))
+			self.spilled = False
+
+	def items(self):
+		group_sids = set(self.memory)
+		if (self.spilled):
+			group_sids.update(row[0] for row in self.conn.execute("SELECT DISTINCT group_sid FROM {}".format(self.table)))
+		for group_sid in group_sids:
+			yield group_sid, self.get(group_sid)
+
+# set up by limit_memory()
+spill = None
+
+def limit_memory(output_folder, max_mb):
+	# keeps db and primary_members within about max_mb MB from now on
+	global db, principals, spill
+	spill = Spill(output_folder, max_mb * 1024 * 1024)
+	entries = db
+	db = new_index()
+	db.update(entries)
+	entries = principals
+	principals = new_index()
+	principals.update(entries)
+
+def new_index():
+	# a DN -> [SID, type] dict, or one that spills with --max-memory
+	if (spill is None):
+		return {}
+	return SpillIndex(spill)
+
+def new_primary(source):
+	# empties primary_members[source], reusing the scratch table if it has one
+	primary = primary_members.get(source)
+	if (isinstance(primary, SpillGroups)):
+		primary.clear()
+	else:
+		primary_members[source] = {} if spill is None else SpillGroups(spill)
+	return primary_members[source]
+
+@functools.lru_cache(maxsize=None)
+def converter_fingerprint(bh_version, encoding):
+	with open(os.path.abspath(__file__), "rb") as infile:
+		return "{}:{}:{}".format(hashlib.sha1(infile.read()).hexdigest(), bh_version, encoding)
+
+def object_fingerprint(obj):
+	# uSNChanged/whenChanged move on every change to an object, fall back to
+	# hashing the whole object for dumps that don't include them
+	attributes = obj['attributes']
+	if ('uSNChanged' in attributes.keys()) or ('whenChanged' in attributes.keys()):
+		return "{}:{}".format(attributes.get('uSNChanged', [None])[0], attributes.get('whenChanged', [None])[0])
+	return hashlib.sha1(json.dumps(obj, sort_keys=True).encode()).hexdigest()
+
+def convert_cached(state, outfile, obj, build, extra=None):
+	# the object rendered for outfile, reused from the incremental state when
+	# the ldapdomaindump object (and extra, for what the object depends on
+	# besides itself) hasn't changed since the last run
+	if (state is None):
+		return outfile.render(build(obj).to_dict())
+	sid = obj['attributes']['objectSid'][0]
+	fp = object_fingerprint(obj)
+	if (extra is not None):
+		fp += ":" + extra
+	text = state.cached_object(outfile.data_type, sid, fp)
+	if (text is None):
+		text = outfile.render(build(obj).to_dict())
+		state.save_object(outfile.data_type, sid, fp, text)
+	return text
+
+def open_state(output, obj_type, bh_version, incremental):
+	if (not incremental):
+		return None
+	state = IndexStore(output.folder)
+	state.begin_objects(obj_type, converter_fingerprint(bh_version, output.encoding()))
+	return state
+
+def close_state(state, obj_type):
+	if (state is not None):
+		state.end_objects(obj_type)
+		state.close()
 
 class User:
 
+	__slots__ = ("AllowedToDelegate", "ObjectIdentifier", "PrimaryGroupSid", "properties", "Aces", "SPNTargets", "HasSIDHistory")
+
 	def __init__(self):
 		self.AllowedToDelegate = []
 		self.ObjectIdentifier = ""
@@ -107,20 +1100,24 @@ class User:
 		self.SPNTargets = []
 		self.HasSIDHistory = []
 
+	def to_dict(self):
+		return {
+			"AllowedToDelegate": self.AllowedToDelegate,
+			"ObjectIdentifier": self.ObjectIdentifier,
+			"PrimaryGroupSid": self.PrimaryGroupSid,
+			"Properties": self.properties,
+			"Aces": self.Aces,
+			"SPNTargets": self.SPNTargets,
+			"HasSIDHistory": self.HasSIDHistory
+		}
+
 	def export(self):
-		buf = '{' + '"AllowedToDelegate": {}, "ObjectIdentifier": "{}", "PrimaryGroupSid": "{}", "Properties": {}, "Aces": {}, "SPNTargets": {}, "HasSIDHistory": {}'.format(
-			self.AllowedToDelegate,
-			self.ObjectIdentifier,
-			self.PrimaryGroupSid,
-			json.dumps(self.properties, indent=4, separators=(",", ": "), sort_keys=False),
-			self.Aces,
-			self.SPNTargets,
-			self.HasSIDHistory
-			) + '}'
-		return python_to_json(json.loads(json.dumps(buf, indent=4, sort_keys=False, separators=(",", ": "))))
+		return json.dumps(self.to_dict())
 
 class Computer:
 
+	__slots__ = ("ObjectIdentifier", "AllowedToAct", "PrimaryGroupSid", "LocalAdmins", "PSRemoteUsers", "properties", "RemoteDesktopUsers", "DcomUsers", "AllowedToDelegate", "Sessions", "Aces")
+
 	def __init__(self):
 		self.ObjectIdentifier = ""
 		self.AllowedToAct = []
@@ -148,25 +1145,28 @@ class Computer:
 		self.Sessions = []
 		self.Aces = []
 
+	def to_dict(self):
+		return {
+			"ObjectIdentifier": self.ObjectIdentifier,
+			"AllowedToAct": self.AllowedToAct,
+			"PrimaryGroupSid": self.PrimaryGroupSid,
+			"LocalAdmins": self.LocalAdmins,
+			"PSRemoteUsers": self.PSRemoteUsers,
+			"Properties": self.properties,
+			"RemoteDesktopUsers": self.RemoteDesktopUsers,
+			"DcomUsers": self.DcomUsers,
+			"AllowedToDelegate": self.AllowedToDelegate,
+			"Sessions": self.Sessions,
+			"Aces": self.Aces
+		}
+
 	def export(self):
-		buf = '{' + '"ObjectIdentifier": "{}", "AllowedToAct": {}, "PrimaryGroupSid": "{}", "LocalAdmins": {}, "PSRemoteUsers": {}, "Properties": {}, "RemoteDesktopUsers": {}, "DcomUsers": {}, "AllowedToDelegate": {}, "Sessions": {}, "Aces": {}'.format(
-			self.ObjectIdentifier,
-			self.AllowedToAct,
-			self.PrimaryGroupSid,
-			json.dumps(self.LocalAdmins),
-			self.PSRemoteUsers,
-			json.dumps(self.properties),
-			self.RemoteDesktopUsers,
-			self.DcomUsers,
-			self.RemoteDesktopUsers,
-			self.AllowedToDelegate,
-			self.Sessions,
-			self.Aces,
-			) + '}'
-		return python_to_json(json.loads(json.dumps(buf, indent=4, sort_keys=False, separators=(",", ": "))))
+		return json.dumps(self.to_dict())
 
 class Group:
 
+	__slots__ = ("ObjectIdentifier", "properties", "Members", "Aces")
+
 	def __init__(self):
 		self.ObjectIdentifier = None
 		self.properties = {
@@ -181,18 +1181,21 @@ class Group:
 		self.Members = []
 		self.Aces = []
 
+	def to_dict(self):
+		return {
+			"ObjectIdentifier": self.ObjectIdentifier,
+			"Properties": self.properties,
+			"Members": self.Members,
+			"Aces": self.Aces
+		}
+
 	def export(self):
-		#self.sanitize()
-		buf = '{' + '"ObjectIdentifier": "{}", "Properties": {}, "Members": {}, "Aces": {}'.format(
-			self.ObjectIdentifier,
-			json.dumps(self.properties),
-			json.dumps(self.Members),
-			self.Aces
-			) + '}'
-		return python_to_json(json.loads(json.dumps(buf, indent=4, sort_keys=False, separators=(",", ": "))))
+		return json.dumps(self.to_dict())
 
 class Domain:
 
+	__slots__ = ("ObjectIdentifier", "properties", "Trusts", "Aces", "Links", "Users", "Computers", "ChildOus")
+
 	def __init__(self):
 		self.ObjectIdentifier = None
 		self.properties = {
@@ -211,480 +1214,1819 @@ class Domain:
 		self.Computers = []
 		self.ChildOus = []
 
+	def to_dict(self):
+		return {
+			"ObjectIdentifier": self.ObjectIdentifier,
+			"Properties": self.properties,
+			"Trusts": self.Trusts,
+			"Aces": self.Aces,
+			"Links": self.Links,
+			"Users": self.Users,
+			"Computers": self.Computers,
+			"ChildOus": self.ChildOus
+		}
+
 	def export(self):
-		buf = '{' + '"ObjectIdentifier": "{}", "Properties": {}, "Trusts": {}, "Aces": {}, "Links": {}, "Users": {}, "Computers": {}, "ChildOus": {}'.format(
-			self.ObjectIdentifier,
-			json.dumps(self.properties),
-			json.dumps(self.Trusts),
-			self.Aces,
-			self.Links,
-			self.Users,
-			self.Computers,
-			self.ChildOus
-			) + '}'
-		return python_to_json(json.loads(json.dumps(buf, indent=4, sort_keys=False, separators=(",", ": "))))
+		return json.dumps(self.to_dict())
+
+# integers with 19 digits or more, which may not fit in 64 bits. Runs of
+# digits are first looked for with digits_only, which turns every digit into
+# 0 and everything else into a space.
+long_int = re.compile(rb'-?\d{19,}')
+digits_only = bytes(48 if chr(i).isdigit() and i < 128 else 32 for i in range(256))
+
+def fits_64_bits(data):
+	# whether every integer in json text data is within int64 or uint64,
+	# also checks digits inside strings, which only costs a json decode
+	if (isinstance(data, str)):
+		data = data.encode("utf-8", "surrogatepass")
+	if (b"0" * 19 not in data.translate(digits_only)):
+		return True
+	for m in long_int.finditer(data):
+		if (not (-2 ** 63 <= int(m.group()) < 2 ** 64)):
+			return False
+	return True
+
+class JsonBackend:
+
+	# The stdlib json module, and the interface of the faster backends. They
+	# are only used where their output is byte for byte what json writes,
+	# and fall back to json for everything else, and their loads() decodes
+	# exactly what json.loads does. fast_loads backends decode elements cut
+	# out of the input by iter_json_bytes.
+	name = "json"
+	fast_loads = False
+	loads = staticmethod(json.loads)
+
+	def compact(self, obj):
+		return json.dumps(obj, sort_keys=False, separators=(",", ":"))
+
+	def pretty(self, obj):
+		return json.dumps(obj, indent=4, sort_keys=False, separators=(",", ": "))
+
+def double_indent(text):
+	# 2 space indentation to 4. Deepest level first, through a placeholder
+	# that json text can't contain, so that every line is widened once.
+	depth = 1
+	while ("\n" + "  " * depth) in text:
+		depth += 1
+	for level in range(depth - 1, 0, -1):
+		text = text.replace("\n" + "  " * level, "\n" + "\0" * level)
+	return text.replace("\0", "    ")
+
+class OrjsonBackend(JsonBackend):
+
+	# orjson writes non-ASCII characters and DEL as they are where json
+	# escapes them, and can't write integers beyond 64 bits. It reads them
+	# as floats and rejects lone surrogates, json decodes those.
+	name = "orjson"
+	fast_loads = True
+
+	def loads(self, data):
+		if (fits_64_bits(data)):
+			try:
+				return orjson.loads(data)
+			except ValueError:
+				pass
+		return json.loads(data)
+
+	def compact(self, obj):
+		try:
+			data = orjson.dumps(obj)
+		except TypeError:
+			return JsonBackend.compact(self, obj)
+		if (data.isascii() and b"\x7f" not in data):
+			return data.decode()
+		return JsonBackend.compact(self, obj)
+
+	def pretty(self, obj):
+		try:
+			data = orjson.dumps(obj, option=orjson.OPT_INDENT_2)
+		except TypeError:
+			return JsonBackend.pretty(self, obj)
+		if (data.isascii() and b"\x7f" not in data):
+			return double_indent(data.decode())
+		return JsonBackend.pretty(self, obj)
+
+class UjsonBackend(JsonBackend):
+
+	# ujson escapes differently from json, so objects with anything that
+	# needs escaping are left to json
+	name = "ujson"
+	fast_loads = True
+
+	def loads(self, data):
+		if (fits_64_bits(data)):
+			try:
+				return ujson.loads(data)
+			except ValueError:
+				pass
+		return json.loads(data)
+
+	def encode(self, obj, indent):
+		try:
+			data = ujson.dumps(obj, ensure_ascii=False, escape_forward_slashes=False, indent=indent)
+		except (OverflowError, TypeError):
+			return None
+		if (data.isascii() and "\\" not in data and "\x7f" not in data):
+			return data
+		return None
+
+	def compact(self, obj):
+		return self.encode(obj, 0) or JsonBackend.compact(self, obj)
+
+	def pretty(self, obj):
+		return self.encode(obj, 4) or JsonBackend.pretty(self, obj)
+
+json_backends = { "orjson": OrjsonBackend, "ujson": UjsonBackend, "json": JsonBackend }
+
+# checked against json before a backend is used, covering everything the
+# converters write
+json_probe = [{
+	"ObjectIdentifier": "S-1-5-21-1004336348-1177238915-682003330-1105",
+	"Properties": { "name": "JDOE@CORP.LOCAL", "enabled": True, "sensitive": False, "email": None, "lastlogon": -1, "pwdlastset": 1632979689, "big": 2 ** 63, "wide": [2 ** 64, -2 ** 63 - 1, -479526344351081010283], "serviceprincipalnames": [], "sidhistory": ["a/b", "<&>"], "description": "Caf\u00e9 \"team\" \\ 1\n2\t\x7f\x01\U0001f600\ud800" },
+	"Aces": [{ "PrincipalSID": "S-1-5-32-544", "IsInherited": False }],
+	"Members": [],
+	"Trusts": {},
+	"meta": { "type": "users", "count": 0, "version": 3 }
+}]
+
+def json_backend_works(backend):
+	reference = JsonBackend()
+	for obj in json_probe + json_probe[0]["Aces"] + [json_probe[0]["Properties"]]:
+		if (backend.compact(obj) != reference.compact(obj) or backend.pretty(obj) != reference.pretty(obj)):
+			return False
+		# compared as text, as 2 ** 64 == 2.0 ** 64
+		if (reference.compact(backend.loads(reference.pretty(obj).encode())) != reference.compact(obj)):
+			return False
+	return True
+
+def choose_json_backend(name=None):
+	# the named backend, or the first one that is installed and writes
+	# exactly what json does
+	for candidate in ([name] if name else json_backends.keys()):
+		if (candidate != "json" and globals()[candidate] is None):
+			continue
+		backend = json_backends[candidate]()
+		if (json_backend_works(backend)):
+			return backend
+	return JsonBackend()
+
+json_backend = choose_json_backend()
+
+def use_json_backend(name):
+	# also the initializer of worker processes, so they use the same backend
+	global json_backend
+	json_backend = choose_json_backend(name)
+
+# https://github.com/dzhibas/SublimePrettyJson/blob/af5a6708d308f60787499e360081bf92afe66156/PrettyJson.py#L48
+# only matches real keys, so a string value containing '": [' is left alone
+bracket_newline = re.compile(r'^((\s*)"(?:[^"\\]|\\.)*":) (\[)', re.MULTILINE)
+
+def pretty_json(obj, depth):
+	# indent=4 output for an object nested `depth` levels deep in the final
+	# file, with the Bloodhound-friendly newline before every list
+	pad = " " * (4 * depth)
+	buf = pad + json_backend.pretty(obj).replace("\n", "\n" + pad)
+	return bracket_newline.sub(r"\1\n\2\3", buf)
+
+class BloodHoundWriter:
+
+	# Streams objects into a Bloodhound json file as they are produced so that
+	# memory use is bounded by a single object. The count in the meta footer
+	# is filled in when the writer is closed. A fragment writer only writes
+	# the objects, for joining back together with append_fragment(). compact
+	# leaves out all the indentation. outfile is only closed along with the
+	# writer when owns_file is set, a file of the caller is just flushed.
+	def __init__(self, outfile, data_type, bh_version, fragment=False, compact=False, owns_file=False):
+		self.outfile = outfile
+		self.owns_file = owns_file
+		self.data_type = data_type
+		self.bh_version = bh_version
+		self.fragment = fragment
+		self.compact = compact
+		self.count = 0
+		if (not fragment):
+			if (compact):
+				self.outfile.write('{"' + data_type + '":[')
+			else:
+				self.outfile.write('{\n    "' + data_type + '":\n    [')
+
+	def render(self, obj):
+		if (self.compact):
+			return json_backend.compact(obj)
+		return pretty_json(obj, 2)
+
+	def write(self, obj):
+		self.write_text(self.render(obj.to_dict()))
+
+	def write_dict(self, obj):
+		self.write_text(self.render(obj))
+
+	def write_text(self, text):
+		# text is an object already rendered with render()
+		if (self.count > 0):
+			self.outfile.write("," if self.compact else ",\n")
+		elif (not self.compact):
+			self.outfile.write("\n")
+		self.outfile.write(text)
+		self.count += 1
+
+	def append_fragment(self, path, count):
+		if (count == 0):
+			return
+		if (self.count > 0):
+			self.outfile.write(",")
+		with open(path, "r") as fragment:
+			shutil.copyfileobj(fragment, self.outfile)
+		self.count += count
+
+	def close(self):
+		if (not self.fragment):
+			meta = { "type": self.data_type, "count": self.count, "version": self.bh_version }
+			if (self.compact):
+				self.outfile.write('],"meta":' + json_backend.compact(meta) + "}")
+			else:
+				if (self.count > 0):
+					self.outfile.write("\n    ")
+				self.outfile.write('],\n    "meta": ')
+				self.outfile.write(pretty_json(meta, 1).lstrip() + "\n}")
+		if (self.owns_file):
+			self.outfile.close()
+		else:
+			self.outfile.flush()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.close()
+
+class ShardedWriter:
+
+	# Splits one object type over users_0001.json, users_0002.json, ... of at
+	# most shard_size objects each, every one a complete Bloodhound file with
+	# its own meta block. Has the same interface as BloodHoundWriter.
+	def __init__(self, output, data_type, bh_version, shard_size, name=None):
+		self.output = output
+		self.data_type = data_type
+		self.bh_version = bh_version
+		self.shard_size = shard_size
+		self.name = name or data_type
+		self.compact = output.compact
+		self.count = 0
+		self.shards = 0
+		self.files = []
+		self.counts = []
+		self.current = None
+
+	def next_shard(self):
+		if (self.current is not None):
+			self.current.close()
+		self.shards += 1
+		name = "{}_{:04d}.json".format(self.name, self.shards)
+		self.files.append(self.output.filename(name))
+		self.counts.append(0)
+		self.current = BloodHoundWriter(self.output.open(name), self.data_type, self.bh_version, compact=self.compact, owns_file=True)
+
+	def render(self, obj):
+		return BloodHoundWriter.render(self, obj)
+
+	def write(self, obj):
+		self.write_text(self.render(obj.to_dict()))
+
+	def write_dict(self, obj):
+		self.write_text(self.render(obj))
+
+	def write_text(self, text):
+		if (self.current is None or self.current.count >= self.shard_size):
+			self.next_shard()
+		self.current.write_text(text)
+		self.counts[-1] += 1
+		self.count += 1
+
+	def adopt(self, path, count):
+		# takes over a finished shard written by a worker process as the
+		# next shard of this writer
+		if (self.current is not None):
+			self.current.close()
+			self.current = None
+		self.shards += 1
+		name = "{}_{:04d}.json".format(self.name, self.shards)
+		self.files.append(self.output.adopt(path, name))
+		self.counts.append(count)
+		self.count += count
+
+	def close(self):
+		if (self.shards == 0):
+			# no objects, still write an empty file
+			self.next_shard()
+		if (self.current is not None):
+			self.current.close()
+			self.current = None
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.close()
+
+class Neo4jWriter:
+
+	# Writes objects as neo4j-admin import CSV instead of Bloodhound json:
+	# users.csv with a node per object and users_edges.csv with the
+	# relationships Bloodhound creates from them when ingesting json. Has the
+	# same interface as BloodHoundWriter.
+	labels = { "users": "User", "computers": "Computer", "groups": "Group", "domains": "Domain" }
+	property_types = {
+		"highvalue": "boolean",
+		"unconstraineddelegation": "boolean",
+		"passwordnotreqd": "boolean",
+		"enabled": "boolean",
+		"dontreqpreauth": "boolean",
+		"pwdneverexpires": "boolean",
+		"sensitive": "boolean",
+		"hasspn": "boolean",
+		"admincount": "boolean",
+		"haslaps": "boolean",
+		"lastlogon": "long",
+		"lastlogontimestamp": "long",
+		"pwdlastset": "long",
+		"serviceprincipalnames": "string[]",
+		"sidhistory": "string[]"
+	}
+	# relationship types of the Aces whose AceType names the right
+	ace_edges = {
+		"All": "AllExtendedRights",
+		"User-Force-Change-Password": "ForceChangePassword",
+		"GetChanges": "GetChanges",
+		"GetChangesAll": "GetChangesAll",
+		"AddMember": "AddMember",
+		"AddAllowedToAct": "AddAllowedToAct"
+	}
+	edge_header = [":START_ID", ":END_ID", ":TYPE", "isacl:boolean", "sidfiltering:boolean", "trusttype:int", "transitive:boolean"]
+
+	def __init__(self, output, data_type, bh_version):
+		self.data_type = data_type
+		self.bh_version = bh_version
+		self.compact = True
+		self.count = 0
+		self.label = "Base;" + self.labels[data_type]
+		obj_type = { "users": User, "computers": Computer, "groups": Group, "domains": Domain }[data_type]
+		self.properties = [key for key in obj_type().properties if key != "objectid"]
+		# trusts can name a domain twice, users and computers are unique
+		self.seen = set() if data_type == "domains" else None
+		self.nodes_file = output.open(data_type + ".csv")
+		self.nodes = csv.writer(self.nodes_file, lineterminator="\n")
+		self.nodes.writerow(["objectid:ID", ":LABEL"] + [self.column(key) for key in self.properties])
+		self.edges_file = output.open(data_type + "_edges.csv")
+		self.edges = csv.writer(self.edges_file, lineterminator="\n")
+		self.edges.writerow(self.edge_header)
+
+	def column(self, key):
+		if (key in self.property_types):
+			return key + ":" + self.property_types[key]
+		return key
+
+	def value(self, key, value):
+		if (value is None):
+			return ""
+		if (isinstance(value, bool)):
+			return "true" if value else "false"
+		if (isinstance(value, list)):
+			return ";".join(str(v) for v in value)
+		return value
+
+	def edge(self, start, end, edge_type, trust=None, acl=False):
+		row = [start, end, edge_type, "true" if acl else "false"]
+		if (trust is not None):
+			row += [self.value("", trust["SidFilteringEnabled"]), trust["TrustType"], self.value("", trust["IsTransitive"])]
+		self.edges.writerow(row)
+
+	def render(self, obj):
+		return json_backend.compact(obj)
+
+	def write(self, obj):
+		self.write_dict(obj.to_dict())
+
+	def write_text(self, text):
+		self.write_dict(json_backend.loads(text))
+
+	def write_dict(self, obj):
+		self.count += 1
+		sid = obj["ObjectIdentifier"]
+		if (not sid):
+			return
+		props = obj["Properties"]
+		if (self.seen is None or sid not in self.seen):
+			self.nodes.writerow([sid, self.label] + [self.value(key, props.get(key)) for key in self.properties])
+			if (self.seen is not None):
+				self.seen.add(sid)
+		# primary group memberships are in the Members of the groups, like
+		# every other membership
+		for m in obj.get("Members", []):
+			self.edge(m["MemberId"], sid, "MemberOf")
+		for admin in obj.get("LocalAdmins", []):
+			self.edge(admin["MemberId"], sid, "AdminTo")
+		for ace in obj.get("Aces", []):
+			self.edge(ace["PrincipalSID"], sid, self.ace_edges.get(ace["AceType"], ace["RightName"]), acl=True)
+		for trust in obj.get("Trusts", []):
+			# 1 inbound: the target trusts us, 2 outbound: we trust the
+			# target, 3 both
+			if (trust["TrustDirection"] in (1, 3)):
+				self.edge(sid, trust["TargetDomainSid"], "TrustedBy", trust)
+			if (trust["TrustDirection"] in (2, 3)):
+				self.edge(trust["TargetDomainSid"], sid, "TrustedBy", trust)
+
+	def close(self):
+		self.nodes_file.close()
+		self.edges_file.close()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.close()
+
+class Output:
+
+	# Where the Bloodhound files go: plain files in the output folder, one
+	# .json.gz per file, or entries streamed into a single zip archive that
+	# Bloodhound can ingest directly.
+	archive_name = "bloodhound.zip"
+
+	def __init__(self, folder, compression=None, compact=False, archive=None, shard_size=0, neo4j=False):
+		self.folder = folder
+		self.compression = compression
+		self.compact = compact
+		self.archive = archive or self.archive_name
+		self.shard_size = shard_size
+		self.neo4j = neo4j
+		self.zipfile = None
+
+	def encoding(self):
+		# what the writers render objects as, for the incremental state
+		if (self.neo4j):
+			return "neo4j"
+		return "compact" if self.compact else "pretty"
+
+	def path(self, name):
+		return self.folder + ret_os_path() + name
+
+	def filename(self, name):
+		# the file (or archive entry) name is written to
+		if (self.compression == "gzip"):
+			return self.path(name + ".gz")
+		if (self.compression == "zip"):
+			return name
+		return self.path(name)
+
+	def open_binary(self, name):
+		if (self.zipfile is None):
+			self.zipfile = zipfile.ZipFile(self.path(self.archive), "w", zipfile.ZIP_DEFLATED)
+		return self.zipfile.open(name, "w", force_zip64=True)
+
+	def open(self, name):
+		if (self.compression == "gzip"):
+			return gzip.open(self.path(name + ".gz"), "wt")
+		if (self.compression == "zip"):
+			return io.TextIOWrapper(self.open_binary(name))
+		return open(self.path(name), "w")
+
+	def open_extra(self, name):
+		# a file that isn't Bloodhound data, kept out of the zip archive
+		if (self.compression == "gzip"):
+			return gzip.open(self.path(name + ".gz"), "wt")
+		return open(self.path(name), "w")
+
+	def remove_stale(self, name, sharded):
+		# files of name left by an earlier run into the folder that this one
+		# won't overwrite: all its shards, which may be more than are written
+		# now or none when sharding was turned off, and the unsharded file
+		# when it was turned on
+		if (self.compression == "zip" or not os.path.isdir(self.folder)):
+			return
+		shard = re.compile(re.escape(name) + r"_\d{4,}\.json(\.gz)?$")
+		for entry in os.listdir(self.folder):
+			if (shard.match(entry) or (sharded and entry in (name + ".json", name + ".json.gz"))):
+				os.remove(self.path(entry))
+
+	def writer(self, data_type, bh_version, name=None):
+		if (self.neo4j and data_type in Neo4jWriter.labels):
+			return stats.writer(Neo4jWriter(self, data_type, bh_version))
+		self.remove_stale(name or data_type, self.shard_size > 0)
+		if (self.shard_size > 0):
+			return stats.writer(ShardedWriter(self, data_type, bh_version, self.shard_size, name))
+		return stats.writer(BloodHoundWriter(self.open((name or data_type) + ".json"), data_type, bh_version, compact=self.compact, owns_file=True))
+
+	def part(self, stage):
+		# worker processes can't share one zip archive, so each stage gets
+		# its own that is merged back in by merge_part()
+		if (self.compression != "zip"):
+			return self
+		return Output(self.folder, self.compression, self.compact, ".{}.part.zip".format(stage), self.shard_size, self.neo4j)
+
+	def spool(self):
+		# plain or gzip files written by a worker and adopt()ed later
+		compression = "gzip" if self.compression == "gzip" else None
+		return Output(self.folder, compression, self.compact, shard_size=self.shard_size, neo4j=self.neo4j)
+
+	def adopt(self, path, name):
+		# moves a finished file from spool() in under name
+		if (self.compression == "zip"):
+			with open(path, "rb") as src, self.open_binary(name) as dst:
+				shutil.copyfileobj(src, dst)
+			os.remove(path)
+			return name
+		target = self.filename(name)
+		os.replace(path, target)
+		return target
+
+	def merge_part(self, part):
+		if (part is self):
+			return
+		part_path = part.path(part.archive)
+		if (not os.path.exists(part_path)):
+			return
+		with zipfile.ZipFile(part_path) as archive:
+			for name in archive.namelist():
+				with archive.open(name) as src, self.open_binary(name) as dst:
+					shutil.copyfileobj(src, dst)
+		os.remove(part_path)
+
+	def close(self):
+		if (self.zipfile is not None):
+			self.zipfile.close()
+			self.zipfile = None
+
+def as_output(output_folder):
+	# the parse_* functions take either an output folder or an Output
+	if isinstance(output_folder, Output):
+		return output_folder
+	return Output(output_folder)
 
 def check(attr, mask):
 	if ((attr & mask) > 0):
 		return True
 	return False
 
+@functools.lru_cache(maxsize=1024)
+def decode_uac(value):
+	# The uac_properties of a userAccountControl value. A domain only has a
+	# handful of distinct values, so each is decoded once and shared by
+	# every object that has it.
+	return { prop: ((value & user_access_control[flag]) != 0) == when_set for prop, (flag, when_set) in uac_properties.items() }
+
+def object_uac(obj):
+	return decode_uac(obj['attributes'].get('userAccountControl', [0])[0])
+
+epoch_ordinal = datetime(1970, 1, 1).toordinal()
+
+@functools.lru_cache(maxsize=4096)
 def to_epoch(longform):
 	# 2021-09-30 05:28:09.685524+00:00
+	# ldapdomaindump writes str(datetime), so apart from the optional fraction
+	# and UTC offset the layout is fixed and can be sliced instead of going
+	# through strptime. Repeated values such as the 1601-01-01 "never"
+	# timestamp are served from the cache.
+	if isinstance(longform, int):
+		# raw FILETIME, 0 and 0x7FFFFFFFFFFFFFFF both mean never
+		if ((longform <= 0) or (longform >= 0x7FFFFFFFFFFFFFFF)):
+			return -1
+		return longform // 10000000 - 11644473600
 	try:
-		utc_time = datetime.strptime(longform, "%Y-%m-%d %H:%M:%S.%f+00:00")
-		epoch_time = int((utc_time - datetime(1970, 1, 1)).total_seconds())
-		return int(epoch_time)
-	except ValueError:
+		if ((len(longform) < 19) or (longform[4] != "-") or (longform[7] != "-") or (longform[10] not in " T") or (longform[13] != ":") or (longform[16] != ":")):
+			return -1
+		utc_time = datetime(int(longform[0:4]), int(longform[5:7]), int(longform[8:10]), int(longform[11:13]), int(longform[14:16]), int(longform[17:19]))
+		rest = longform[19:]
+
+		micro = 0
+		if (rest[:1] == "."):
+			end = 1
+			while ((end < len(rest)) and rest[end].isdigit()):
+				end += 1
+			if ((end == 1) or (end > 7)):
+				return -1
+			micro = int(rest[1:end].ljust(6, "0"))
+			rest = rest[end:]
+
+		offset = 0
+		if ((len(rest) == 6) and (rest[0] in "+-") and (rest[3] == ":")):
+			offset = int(rest[1:3]) * 3600 + int(rest[4:6]) * 60
+			if (rest[0] == "-"):
+				offset = -offset
+		elif (rest not in ("", "Z")):
+			return -1
+	except (ValueError, TypeError):
 		return -1
 
-def parse_users(input_folder, output_folder, bh_version):
-	# https://github.com/dzhibas/SublimePrettyJson/blob/af5a6708d308f60787499e360081bf92afe66156/PrettyJson.py#L48
-	brace_newline = re.compile(r'^((\s*)".*?":)\s*([{])', re.MULTILINE)
-	bracket_newline = re.compile(r'^((\s*)".*?":)\s*([\[])', re.MULTILINE)
-	count = 0
-	j = json.loads(open(input_folder + ret_os_path() + "domain_users.json", "r").read())
-	buf = '{"users": ['
-	for user in j:
-		u = User()
-		u.ObjectIdentifier = user['attributes']['objectSid'][0]
-		u.PrimaryGroupSid = '-'.join(user['attributes']['objectSid'][0].split("-")[:-1]) + "-" + str(user['attributes']['primaryGroupID'][0])
-
-		if (('userPrincipalName' in user['attributes'].keys()) and ("/" not in str(user['attributes']['userPrincipalName'][0]))):
-			u.properties['name'] = str(user['attributes']['userPrincipalName'][0]).upper()
-		else:
-			u.properties['name'] = str(user['attributes']['sAMAccountName'][0]).upper() + "@" + '.'.join(str(user['attributes']['distinguishedName'][0]).split(",DC=")[1:]).upper()
-
-		if 'userPrincipalName' in user['attributes'].keys():
-			if "@" in str(user['attributes']['userPrincipalName'][0]):
-				u.properties['domain'] = str(user['attributes']['userPrincipalName'][0]).upper().split("@")[1]
-			else:
-				u.properties['domain'] = str(user['attributes']['userPrincipalName'][0]).upper()
-		else:
-			u.properties['domain'] = str(u.properties["name"]).upper().split("@")[1]
-
-		u.properties['objectid'] = user['attributes']['objectSid'][0]
-		u.properties['distinguishedname'] = user['attributes']['distinguishedName'][0]
-
-		if ("$" in u.properties['distinguishedname']):
-			db[u.properties['distinguishedname']] = [u.ObjectIdentifier, "Computer"]
-		else:
-			db[u.properties['distinguishedname']] = [u.ObjectIdentifier, "User"]
-
-		u.properties['highvalue'] = False
-		for h in hvt:
-			if (h in str(user['attributes']['primaryGroupID'][0])):
-				u.properties['highvalue'] = True
-
-
-		u.properties['unconstraineddelegation'] = False
-		if check(user['attributes']['userAccountControl'][0], user_access_control['TRUSTED_FOR_DELEGATION']):
-			u.properties['unconstraineddelegation'] = True
-
-		# PASSWD_NOTREQD = 0x0020
-		u.properties["passwordnotreqd"] = False
-		if check(user['attributes']['userAccountControl'][0], user_access_control['PASSWD_NOTREQD']):
-			u.properties["passwordnotreqd"] = True
-
-		# ACCOUNTDISABLE = 0x0002
-		u.properties["enabled"] = False
-		if (not check(user['attributes']['userAccountControl'][0], user_access_control['ACCOUNTDISABLE'])):
-			u.properties['enabled'] = True
+	if (utc_time.year <= 1601):
+		return -1
+	epoch_time = (utc_time.toordinal() - epoch_ordinal) * 86400 + utc_time.hour * 3600 + utc_time.minute * 60 + utc_time.second - offset
+	# int() of the fractional seconds truncates towards zero
+	if ((micro > 0) and (epoch_time < 0)):
+		epoch_time += 1
+	return epoch_time
+
+def domain_sid(sid):
+	# S-1-5-21-a-b-c-1105 -> the interned S-1-5-21-a-b-c
+	prefix = sid[:sid.rfind("-")]
+	return domain_prefixes.setdefault(prefix, prefix)
+
+def rid_sid(domain, rid):
+	# the interned SID of a RID in domain
+	key = (domain, rid)
+	sid = rid_sids.get(key)
+	if (sid is None):
+		sid = rid_sids[key] = domain + "-" + str(rid)
+	return sid
+
+def index_primary(source, obj, entry):
+	rid = obj['attributes'].get('primaryGroupID')
+	if (not rid):
+		return
+	primary_members[source].setdefault(rid_sid(domain_sid(entry[0]), rid[0]), []).append(entry)
 
-		if 'lastLogon' in user['attributes'].keys():
-			u.properties['lastlogon'] = to_epoch(user['attributes']['lastLogon'][0])
-		else:
-			u.properties['lastlogon'] = -1
+def index_user(user):
+	dn = user['attributes']['distinguishedName'][0]
+	if ("$" in dn):
+		entry = db[dn] = [user['attributes']['objectSid'][0], "Computer"]
+	else:
+		entry = db[dn] = [user['attributes']['objectSid'][0], "User"]
+	index_primary("users", user, entry)
+	return dn
+
+def index_computer(comp):
+	index_primary("computers", comp, [comp['attributes']['objectSid'][0], "Computer"])
+
+def merge_primary(primary):
+	# adds the primary_members of a worker, in the order they are merged
+	for source, groups in primary.items():
+		target = primary_members.setdefault(source, {})
+		for group_sid, members in groups.items():
+			target.setdefault(group_sid, []).extend(members)
+
+def build_user(user):
+	u = User()
+	u.ObjectIdentifier = user['attributes']['objectSid'][0]
+	u.PrimaryGroupSid = rid_sid(domain_sid(user['attributes']['objectSid'][0]), user['attributes']['primaryGroupID'][0])
+
+	if (('userPrincipalName' in user['attributes'].keys()) and ("/" not in str(user['attributes']['userPrincipalName'][0]))):
+		u.properties['name'] = str(user['attributes']['userPrincipalName'][0]).upper()
+	else:
+		u.properties['name'] = str(user['attributes']['sAMAccountName'][0]).upper() + "@" + '.'.join(str(user['attributes']['distinguishedName'][0]).split(",DC=")[1:]).upper()
 
-		if 'lastLogonTimestamp' in user['attributes'].keys():
-			u.properties['lastlogontimestamp'] = to_epoch(user['attributes']['lastLogonTimestamp'][0])
+	if 'userPrincipalName' in user['attributes'].keys():
+		if "@" in str(user['attributes']['userPrincipalName'][0]):
+			u.properties['domain'] = str(user['attributes']['userPrincipalName'][0]).upper().split("@")[1]
 		else:
-			u.properties['lastlogontimestamp'] = -1
+			u.properties['domain'] = str(user['attributes']['userPrincipalName'][0]).upper()
+	else:
+		u.properties['domain'] = str(u.properties["name"]).upper().split("@")[1]
 
-		if 'pwdLastSet' in user['attributes'].keys():
-			u.properties['pwdlastset'] = to_epoch(user['attributes']['pwdLastSet'][0])
-		else:
-			u.properties['pwdlastset'] = -1
+	u.properties['objectid'] = user['attributes']['objectSid'][0]
+	u.properties['distinguishedname'] = user['attributes']['distinguishedName'][0]
 
-		u.properties['dontreqpreauth'] = False
-		if check(user['attributes']['userAccountControl'][0], user_access_control['DONT_REQ_PREAUTH']):
-			u.properties["dontreqpreauth"] = True
+	u.properties['highvalue'] = False
+	for h in hvt:
+		if (h in str(user['attributes']['primaryGroupID'][0])):
+			u.properties['highvalue'] = True
 
-		u.properties['pwdneverexpires'] = False
-		if check(user['attributes']['userAccountControl'][0], user_access_control['DONT_EXPIRE_PASSWORD']):
-			u.properties["pwdneverexpires"] = True
+	uac = object_uac(user)
+	u.properties['unconstraineddelegation'] = uac['unconstraineddelegation']
+	u.properties["passwordnotreqd"] = uac['passwordnotreqd']
+	u.properties["enabled"] = uac['enabled']
 
-		u.properties['sensitive'] = False
-		u.properties['serviceprincipalnames'] = []
+	if 'lastLogon' in user['attributes'].keys():
+		u.properties['lastlogon'] = to_epoch(user['attributes']['lastLogon'][0])
+	else:
+		u.properties['lastlogon'] = -1
 
-		if 'servicePrincipalName' in user['attributes'].keys():
-			u.properties['hasspn'] = True
-			for spn in user['attributes']['servicePrincipalName']:
-				u.properties['serviceprincipalnames'].append(spn)
-		else:
-			u.properties['hasspn'] = False
+	if 'lastLogonTimestamp' in user['attributes'].keys():
+		u.properties['lastlogontimestamp'] = to_epoch(user['attributes']['lastLogonTimestamp'][0])
+	else:
+		u.properties['lastlogontimestamp'] = -1
 
+	if 'pwdLastSet' in user['attributes'].keys():
+		u.properties['pwdlastset'] = to_epoch(user['attributes']['pwdLastSet'][0])
+	else:
+		u.properties['pwdlastset'] = -1
 
-		if 'displayName' in user['attributes'].keys():
-			u.properties['displayname'] = user['attributes']['displayName'][0]
-		else:
-			u.properties['displayname'] = user['attributes']['sAMAccountName'][0]
+	u.properties['dontreqpreauth'] = uac['dontreqpreauth']
+	u.properties['pwdneverexpires'] = uac['pwdneverexpires']
+	u.properties['sensitive'] = uac['sensitive']
+	u.properties['serviceprincipalnames'] = []
 
-		u.properties['email'] = None
-		u.properties['title'] = None
-		u.properties['homedirectory'] = None
+	if 'servicePrincipalName' in user['attributes'].keys():
+		u.properties['hasspn'] = True
+		for spn in user['attributes']['servicePrincipalName']:
+			u.properties['serviceprincipalnames'].append(spn)
+	else:
+		u.properties['hasspn'] = False
 
-		if 'description' in user['attributes'].keys():
-			u.properties['description'] = user['attributes']['description'][0]
-		else:
-			u.properties['description'] = None
 
-		u.properties['userpassword'] = None
+	if 'displayName' in user['attributes'].keys():
+		u.properties['displayname'] = user['attributes']['displayName'][0]
+	else:
+		u.properties['displayname'] = user['attributes']['sAMAccountName'][0]
 
-		if 'adminCount' in user['attributes'].keys():
-			u.properties['admincount'] = True
-		else:
-			u.properties['admincount'] = False
-
-		u.properties['sidhistory'] = []
-
-		u.Aces = []
-		u.SPNTargets = []
-		u.HasSIDHistory = []
-
-		buf += u.export() + ', '
-		count += 1
-
-	with open(output_folder + ret_os_path() + "users.json", "w") as outfile:
-		buf = bracket_newline.sub(r"\1\n\2\3", bracket_newline.sub(r"\1\n\2\3", json.dumps(json.loads(buf[:-2] + '],' + ' "meta": ' + '{' + '"type": "users", "count": {}, "version": {}'.format(count, bh_version) + '}}'), indent=4, sort_keys=False, separators=(",", ": "))))
-		outfile.write(buf)
-	buf = ""
-
-def build_la_dict(domain_sid, group_sid, member_type):
-	return { "MemberId" : domain_sid + '-' + group_sid, "MemberType": member_type }
-
-def parse_computers(input_folder, output_folder, bh_version):
-	# https://github.com/dzhibas/SublimePrettyJson/blob/af5a6708d308f60787499e360081bf92afe66156/PrettyJson.py#L48
-	brace_newline = re.compile(r'^((\s*)".*?":)\s*([{])', re.MULTILINE)
-	bracket_newline = re.compile(r'^((\s*)".*?":)\s*([\[])', re.MULTILINE)
-	count = 0
-	j = json.loads(open(input_folder + ret_os_path() + "domain_computers.json", "r").read())
-	buf = '{"computers": ['
-	for comp in j:
-		c = Computer()
-		c.ObjectIdentifier = comp['attributes']['objectSid'][0]
-		c.AllowedToAct = []
-		c.PrimaryGroupSid = '-'.join(comp['attributes']['objectSid'][0].split("-")[:-1]) + "-" + str(comp['attributes']['primaryGroupID'][0])
-
-		sid = '-'.join(comp['attributes']['objectSid'][0].split("-")[:-1])
-		c.LocalAdmins = []
-		c.LocalAdmins.append(build_la_dict(sid, "519", "Group"))
-		c.LocalAdmins.append(build_la_dict(sid, "512", "Group"))
-		c.LocalAdmins.append(build_la_dict(sid, "500", "User"))
-
-		c.PSRemoteUsers = []
-
-		if 'dNSHostName' in comp['attributes'].keys():
-			c.properties["name"] = str(comp['attributes']['dNSHostName'][0]).upper()
-		else:
-			c.properties["name"] = str(comp['attributes']['distinguishedName'][0]).split(",CN=")[0].split("=")[1].replace(",OU", "") + "." + '.'.join(str(comp['attributes']['distinguishedName'][0]).split(",DC=")[1:]).upper()
+	u.properties['email'] = None
+	u.properties['title'] = None
+	u.properties['homedirectory'] = None
 
-		if 'userPrincipalName' in comp['attributes'].keys():
-			c.properties["domain"] = str(comp['attributes']['userPrincipalName'][0]).upper().split(".")[1:]
-		elif ("." in str(c.properties["name"])):
-			c.properties["domain"] = '.'.join(str(c.properties["name"]).upper().split(".")[1:])
-		else:
-			# need to manually build domain based off object
-			c.properties["domain"] = '.'.join(str(comp['attributes']['distinguishedName'][0]).split(",DC=")[1:]).upper()
+	if 'description' in user['attributes'].keys():
+		u.properties['description'] = user['attributes']['description'][0]
+	else:
+		u.properties['description'] = None
 
-		c.properties["objectid"] = comp['attributes']['objectSid'][0]
+	u.properties['userpassword'] = None
 
-		c.properties["distinguishedname"] = comp['attributes']['distinguishedName'][0]
+	if 'adminCount' in user['attributes'].keys():
+		u.properties['admincount'] = True
+	else:
+		u.properties['admincount'] = False
+
+	u.properties['sidhistory'] = []
+
+	u.Aces = object_aces(user, "User")
+	u.SPNTargets = []
+	u.HasSIDHistory = []
+
+	return u
+
+@instrumented("users", "domain_users")
+def parse_users(input_folder, output_folder, bh_version, index=False, incremental=False):
+	output = as_output(output_folder)
+	users_file = input_file(input_folder, "domain_users")
+	user_index = new_index()
+	state = open_state(output, "users", bh_version, incremental)
+	outfile = output.writer("users", bh_version)
+	new_primary("users")
+	if (state is None):
+		for u in convert_users(users_file):
+			if (index):
+				dn = u.properties['distinguishedname']
+				user_index[dn] = db[dn]
+			outfile.write(u)
+	else:
+		for user in read_records(users_file):
+			# unchanged users are not rebuilt, but groups still need their DNs
+			dn = index_user(user)
+			if (index):
+				user_index[dn] = db[dn]
+			outfile.write_text(convert_cached(state, outfile, user, build_user))
+	outfile.close()
+	close_state(state, "users")
+
+	if (index):
+		save_user_index(output.folder, users_file, user_index)
+
+def save_user_index(output_folder, users_file, user_index, source="users"):
+	store = IndexStore(output_folder)
+	store.save(source, fingerprint(users_file), user_index, primary_members[source])
+	store.close()
+
+def build_la_dict(domain, group_sid, member_type):
+	return { "MemberId" : rid_sid(domain, group_sid), "MemberType": member_type }
+
+def build_computer(comp):
+	c = Computer()
+	c.ObjectIdentifier = comp['attributes']['objectSid'][0]
+	c.AllowedToAct = []
+	sid = domain_sid(comp['attributes']['objectSid'][0])
+	c.PrimaryGroupSid = rid_sid(sid, comp['attributes']['primaryGroupID'][0])
+
+	c.LocalAdmins = []
+	c.LocalAdmins.append(build_la_dict(sid, "519", "Group"))
+	c.LocalAdmins.append(build_la_dict(sid, "512", "Group"))
+	c.LocalAdmins.append(build_la_dict(sid, "500", "User"))
+
+	c.PSRemoteUsers = []
+
+	if 'dNSHostName' in comp['attributes'].keys():
+		c.properties["name"] = str(comp['attributes']['dNSHostName'][0]).upper()
+	else:
+		c.properties["name"] = str(comp['attributes']['distinguishedName'][0]).split(",CN=")[0].split("=")[1].replace(",OU", "") + "." + '.'.join(str(comp['attributes']['distinguishedName'][0]).split(",DC=")[1:]).upper()
 
-		c.properties["highvalue"] = False
-		for h in hvt:
-			if (h in str(comp['attributes']['primaryGroupID'][0])):
-				c.properties["highvalue"] = True
+	if 'userPrincipalName' in comp['attributes'].keys():
+		c.properties["domain"] = str(comp['attributes']['userPrincipalName'][0]).upper().split(".")[1:]
+	elif ("." in str(c.properties["name"])):
+		c.properties["domain"] = '.'.join(str(c.properties["name"]).upper().split(".")[1:])
+	else:
+		# need to manually build domain based off object
+		c.properties["domain"] = '.'.join(str(comp['attributes']['distinguishedName'][0]).split(",DC=")[1:]).upper()
 
-		if 'userAccountControl' in comp['attributes'].keys():
-			if check(comp['attributes']['userAccountControl'][0], user_access_control['TRUSTED_FOR_DELEGATION']):
-				c.properties['unconstraineddelegation'] = True
-		else:
-			c.properties['unconstraineddelegation'] = False
+	c.properties["objectid"] = comp['attributes']['objectSid'][0]
 
+	c.properties["distinguishedname"] = comp['attributes']['distinguishedName'][0]
 
-		c.properties["enabled"] = False
-		if (not check(comp['attributes']['userAccountControl'][0], user_access_control['ACCOUNTDISABLE'])):
-			c.properties['enabled'] = True
+	c.properties["highvalue"] = False
+	for h in hvt:
+		if (h in str(comp['attributes']['primaryGroupID'][0])):
+			c.properties["highvalue"] = True
 
-		c.properties['haslaps'] = False # TDODO
+	uac = object_uac(comp)
+	c.properties['unconstraineddelegation'] = uac['unconstraineddelegation']
+	c.properties["enabled"] = uac['enabled']
 
-		if 'lastLogonTimestamp' in comp['attributes'].keys():
-			c.properties['lastlogontimestamp'] = to_epoch(comp['attributes']['lastLogonTimestamp'][0])
-		else:
-			c.properties['lastlogontimestamp'] = -1
+	c.properties['haslaps'] = False # TDODO
 
-		if 'pwdLastSet' in comp['attributes'].keys():
-			c.properties['pwdlastset'] = to_epoch(comp['attributes']['pwdLastSet'][0])
-		else:
-			c.properties['pwdlastset'] = -1
+	if 'lastLogonTimestamp' in comp['attributes'].keys():
+		c.properties['lastlogontimestamp'] = to_epoch(comp['attributes']['lastLogonTimestamp'][0])
+	else:
+		c.properties['lastlogontimestamp'] = -1
 
-		if 'servicePrincipalName' in comp['attributes'].keys():
-			c.properties['serviceprincipalnames'] = comp['attributes']['servicePrincipalName']
-		else:
-			c.properties['serviceprincipalnames'] = None
+	if 'pwdLastSet' in comp['attributes'].keys():
+		c.properties['pwdlastset'] = to_epoch(comp['attributes']['pwdLastSet'][0])
+	else:
+		c.properties['pwdlastset'] = -1
 
-		if 'description' in comp['attributes'].keys():
-			c.properties['description'] = comp['attributes']['description'][0]
-		else:
-			c.properties['description'] = None
+	if 'servicePrincipalName' in comp['attributes'].keys():
+		c.properties['serviceprincipalnames'] = comp['attributes']['servicePrincipalName']
+	else:
+		c.properties['serviceprincipalnames'] = None
 
-		if 'operatingSystem' in comp['attributes'].keys():
-			c.properties['operatingsystem'] = comp['attributes']['operatingSystem']
-		else:
-			c.properties['operatingsystem'] = None
+	if 'description' in comp['attributes'].keys():
+		c.properties['description'] = comp['attributes']['description'][0]
+	else:
+		c.properties['description'] = None
 
-		buf += c.export() + ', '
-		count += 1
+	if 'operatingSystem' in comp['attributes'].keys():
+		c.properties['operatingsystem'] = comp['attributes']['operatingSystem']
+	else:
+		c.properties['operatingsystem'] = None
+
+	c.Aces = object_aces(comp, "Computer")
+
+	return c
+
+@instrumented("computers", "domain_computers")
+def parse_computers(input_folder, output_folder, bh_version, incremental=False, index=False):
+	output = as_output(output_folder)
+	state = open_state(output, "computers", bh_version, incremental)
+	outfile = output.writer("computers", bh_version)
+	computers = input_file(input_folder, "domain_computers")
+	new_primary("computers")
+	if (state is None):
+		for c in convert_computers(computers):
+			outfile.write(c)
+	else:
+		for comp in read_records(computers):
+			index_computer(comp)
+			outfile.write_text(convert_cached(state, outfile, comp, build_computer))
+	outfile.close()
+	close_state(state, "computers")
 
-	with open(output_folder + ret_os_path() + "computers.json", "w") as outfile:
-		buf = bracket_newline.sub(r"\1\n\2\3", bracket_newline.sub(r"\1\n\2\3", json.dumps(json.loads(buf[:-2] + '],' + ' "meta": ' + '{' + '"type": "computers", "count": {}, "version": {}'.format(count, bh_version) + '}}'), indent=4, sort_keys=False, separators=(",", ": "))))
-		outfile.write(buf)
-	buf = ""
+	if (index):
+		save_user_index(output.folder, computers, {}, "computers")
 
 def build_mem_dict(sid, member_type):
 	return { "MemberId" : sid, "MemberType": member_type }
 
-def parse_groups(input_folder, output_folder, no_users, bh_version):
-	# https://github.com/dzhibas/SublimePrettyJson/blob/af5a6708d308f60787499e360081bf92afe66156/PrettyJson.py#L48
-	brace_newline = re.compile(r'^((\s*)".*?":)\s*([{])', re.MULTILINE)
-	bracket_newline = re.compile(r'^((\s*)".*?":)\s*([\[])', re.MULTILINE)
-	count = 0
-
-	if (no_users):
-		j = json.loads(open(input_folder + ret_os_path() + "domain_users.json", "r").read())
-		for user in j:
-			u = user['attributes']['distinguishedName'][0]
-			if ("$" in u):
-				db[u] = [user['attributes']['objectSid'][0], "Computer"]
-			else:
-				db[u] = [user['attributes']['objectSid'][0], "User"]
-
-	j = json.loads(open(input_folder + ret_os_path() + "domain_groups.json", "r").read())
-
-	# fist build up group sids
-	for group in j:
-		db[group['attributes']['distinguishedName'][0]] = [group['attributes']['objectSid'][0], "Group"]
-
-	buf = '{"groups": ['
-	# now build up the whole file
-	for group in j:
-		g = Group()
-		g.ObjectIdentifier = group['attributes']['objectSid'][0]
-
-		if 'userPrincipalName' in group['attributes'].keys():
-			g.properties['name'] = str(group['attributes']['userPrincipalName'][0]).upper()
+def load_user_index(input_folder, output_folder, index=False):
+	# fill db from domain_users.json without converting the users, or from
+	# the index store when it was built from this exact file
+	users_file = input_file(input_folder, "domain_users")
+	if (index):
+		store = IndexStore(output_folder)
+		fp = fingerprint(users_file)
+		if (store.is_current("users", fp)):
+			store.load("users", db)
+			store.close()
+			return
+		store.close()
+
+	user_index = new_index()
+	new_primary("users")
+	for user in read_records(users_file):
+		u = user['attributes']['distinguishedName'][0]
+		if ("$" in u):
+			user_index[u] = [user['attributes']['objectSid'][0], "Computer"]
 		else:
-			g.properties['name'] = str(group['attributes']['distinguishedName'][0]).split(",CN=")[0].split("=")[1].replace(",OU", "").upper() + "@" + '.'.join(str(group['attributes']['distinguishedName'][0]).split(",DC=")[1:]).upper()
-
-		if 'userPrincipalName' in group['attributes'].keys():
-			g.properties['domain'] = str(group['attributes']['userPrincipalName'][0]).upper().split("@")[1]
-		else:
-			g.properties['domain'] = str(g.properties["name"]).upper().split("@")[1]
+			user_index[u] = [user['attributes']['objectSid'][0], "User"]
+		index_primary("users", user, user_index[u])
+	db.update(user_index)
+
+	if (index):
+		save_user_index(output_folder, users_file, user_index)
+
+def load_computer_index(input_folder, output_folder, index=False):
+	# the primary groups of the computers, for groups converted without the
+	# computers stage
+	computers = input_file(input_folder, "domain_computers")
+	if (not os.path.exists(computers)):
+		return
+	if (index):
+		store = IndexStore(output_folder)
+		if (store.is_current("computers", fingerprint(computers))):
+			store.load("computers", db)
+			store.close()
+			return
+		store.close()
+
+	new_primary("computers")
+	for comp in read_records(computers):
+		index_computer(comp)
+
+	if (index):
+		save_user_index(output_folder, computers, {}, "computers")
+
+def index_groups(records):
+	for group in records:
+		db[group['attributes']['distinguishedName'][0]] = [group['attributes']['objectSid'][0], "Group"]
 
-		g.properties['objectid'] = group['attributes']['objectSid'][0]
+def build_group(group):
+	g = Group()
+	g.ObjectIdentifier = group['attributes']['objectSid'][0]
 
-		g.properties['highvalue'] = False
-		for h in hvt:
-			if (h in str(group['attributes']['objectSid'][0]).split("-")[-1:]):
-				g.properties['highvalue'] = True
+	if 'userPrincipalName' in group['attributes'].keys():
+		g.properties['name'] = str(group['attributes']['userPrincipalName'][0]).upper()
+	else:
+		g.properties['name'] = str(group['attributes']['distinguishedName'][0]).split(",CN=")[0].split("=")[1].replace(",OU", "").upper() + "@" + '.'.join(str(group['attributes']['distinguishedName'][0]).split(",DC=")[1:]).upper()
 
-		g.properties['distinguishedname'] = group['attributes']['distinguishedName'][0]
+	if 'userPrincipalName' in group['attributes'].keys():
+		g.properties['domain'] = str(group['attributes']['userPrincipalName'][0]).upper().split("@")[1]
+	else:
+		g.properties['domain'] = str(g.properties["name"]).upper().split("@")[1]
 
-		if 'adminCount' in group['attributes'].keys():
-			g.properties['admincount'] = True
-		else:
-			g.properties['admincount'] = False
+	g.properties['objectid'] = group['attributes']['objectSid'][0]
 
-		if 'description' in group['attributes'].keys():
-			g.properties['description'] = group['attributes']['description'][0]
-		else:
-			g.properties['description'] = None
+	g.properties['highvalue'] = False
+	for h in hvt:
+		if (h == str(group['attributes']['objectSid'][0]).rpartition("-")[2]):
+			g.properties['highvalue'] = True
 
-		try:
-			for m in group['attributes']['member']:
-				t = db[m]
-				g.Members.append(build_mem_dict(t[0], t[1]))
-		except:
-			pass
+	g.properties['distinguishedname'] = group['attributes']['distinguishedName'][0]
 
-		buf += g.export() + ', '
-		count += 1
+	if 'adminCount' in group['attributes'].keys():
+		g.properties['admincount'] = True
+	else:
+		g.properties['admincount'] = False
 
-	with open(output_folder + ret_os_path() + "groups.json", "w") as outfile:
-		buf = bracket_newline.sub(r"\1\n\2\3", bracket_newline.sub(r"\1\n\2\3", json.dumps(json.loads(buf[:-2] + '],' + ' "meta": ' + '{' + '"type": "groups", "count": {}, "version": {}'.format(count, bh_version) + '}}'), indent=4, sort_keys=False, separators=(",", ": "))))
-		outfile.write(buf)
-	buf = ""
+	if 'description' in group['attributes'].keys():
+		g.properties['description'] = group['attributes']['description'][0]
+	else:
+		g.properties['description'] = None
+
+	g.Members = resolve_members(group)
+	g.Aces = object_aces(group, "Group")
+
+	return g
+
+def resolve_members(group):
+	# members that aren't in db (e.g. from another domain) are skipped,
+	# members through their primaryGroupID come after the member attribute
+	members = []
+	for m in group['attributes'].get('member', []):
+		t = db.get(m)
+		if (t is not None):
+			members.append(build_mem_dict(t[0], t[1]))
+	sid = group['attributes']['objectSid'][0]
+	seen = None
+	for source in primary_members.values():
+		for t in source.get(sid, ()):
+			if (seen is None):
+				seen = set(m["MemberId"] for m in members)
+			if (t[0] not in seen):
+				members.append(build_mem_dict(t[0], t[1]))
+	return members
+
+def primary_fingerprint(group):
+	# the incremental state of a group has to change with its primary group
+	# members too, whose objects change instead of the group
+	h = hashlib.sha1()
+	sid = group['attributes']['objectSid'][0]
+	for source in primary_members.values():
+		for t in source.get(sid, ()):
+			h.update(t[0].encode())
+	return h.hexdigest()
+
+def add_memberships(memberships, group_sid, members):
+	# memberships as taken by write_memberships
+	for m in members:
+		memberships.setdefault(m["MemberId"], [m["MemberType"], []])[1].append(group_sid)
+
+def transitive_closure(parents):
+	# parents[i] lists the ids of the groups that group i is directly a
+	# member of. Returns, per group id, a bitset of every group it is a
+	# member of through any chain of nesting. Groups are condensed into
+	# strongly connected components (Tarjan) first so nesting cycles are
+	# handled, and each component is visited once after all of its parents.
+	n = len(parents)
+	index = [None] * n
+	low = [0] * n
+	on_stack = [False] * n
+	stack = []
+	closure = [0] * n
+	counter = 0
+	for root in range(n):
+		if (index[root] is not None):
+			continue
+		work = [(root, 0)]
+		while work:
+			v, i = work.pop()
+			if (i == 0):
+				index[v] = low[v] = counter
+				counter += 1
+				stack.append(v)
+				on_stack[v] = True
+			else:
+				# back from the parent visited through edge i - 1
+				low[v] = min(low[v], low[parents[v][i - 1]])
+			descended = False
+			while i < len(parents[v]):
+				w = parents[v][i]
+				i += 1
+				if (index[w] is None):
+					work.append((v, i))
+					work.append((w, 0))
+					descended = True
+					break
+				elif (on_stack[w]):
+					low[v] = min(low[v], index[w])
+			if (descended or low[v] != index[v]):
+				continue
+			component = []
+			while True:
+				w = stack.pop()
+				on_stack[w] = False
+				component.append(w)
+				if (w == v):
+					break
+			bits = 0
+			for w in component:
+				for p in parents[w]:
+					bits |= (1 << p) | closure[p]
+			for w in component:
+				closure[w] = bits & ~(1 << w)
+	return closure
+
+def write_memberships(output, memberships):
+	# memberships maps a member SID to [member type, [group SIDs it is
+	# directly in]]. Writes every principal's effective group memberships
+	# as a json array, one member per line. It isn't a Bloodhound file, so
+	# it has no meta block and is written next to a zip archive, not in it.
+	group_sids = list(dict.fromkeys(sid for _, groups in memberships.values() for sid in groups))
+	ids = { sid: i for i, sid in enumerate(group_sids) }
+	parents = [[ids[p] for p in memberships[sid][1]] if sid in memberships else [] for sid in group_sids]
+	closure = transitive_closure(parents)
+
+	with output.open_extra("memberships.json") as outfile:
+		outfile.write("[")
+		separator = "\n"
+		for sid, (member_type, groups) in memberships.items():
+			bits = 0
+			for p in groups:
+				bits |= (1 << ids[p]) | closure[ids[p]]
+			member_of = []
+			while bits:
+				low_bit = bits & -bits
+				member_of.append(group_sids[low_bit.bit_length() - 1])
+				bits ^= low_bit
+			outfile.write(separator + json_backend.compact({ "ObjectIdentifier": sid, "ObjectType": member_type, "MemberOf": member_of }))
+			separator = ",\n"
+		outfile.write("\n]\n")
+
+@instrumented("groups", "domain_groups")
+def parse_groups(input_folder, output_folder, no_users, bh_version, index=False, incremental=False, nested=False):
+	output = as_output(output_folder)
+	if (no_users):
+		load_user_index(input_folder, output.folder, index)
+	if ("computers" not in primary_members):
+		load_computer_index(input_folder, output.folder, index)
+
+	groups_file = input_file(input_folder, "domain_groups")
+
+	state = open_state(output, "groups", bh_version, incremental)
+	outfile = output.writer("groups", bh_version)
+	memberships = {}
+	if (state is None):
+		for g in convert_groups(groups_file):
+			outfile.write(g)
+			if (nested):
+				add_memberships(memberships, g.ObjectIdentifier, g.Members)
+	else:
+		index_groups(read_records(groups_file))
+		for group in read_records(groups_file):
+			outfile.write_text(convert_cached(state, outfile, group, build_group, extra=primary_fingerprint(group)))
+			if (nested):
+				add_memberships(memberships, group['attributes']['objectSid'][0], resolve_members(group))
+	outfile.close()
+	close_state(state, "groups")
+
+	if (nested):
+		write_memberships(output, memberships)
+
+def str_to_sid(sid):
+	# S-1-5-21-... back to the binary form sid_to_str reads
+	parts = sid.split("-")
+	sub_authorities = [int(x) for x in parts[3:]]
+	return sid_struct(len(sub_authorities)).pack(int(parts[1]), len(sub_authorities), int(parts[2], 0).to_bytes(6, "big"), *sub_authorities)
+
+@functools.lru_cache(maxsize=None)
+def sid_struct(sub_authorities):
+	# revision, sub authority count, 48 bit big endian identifier authority,
+	# then the little endian 32 bit sub authorities
+	return struct.Struct("<BB6s{}I".format(sub_authorities))
 
-# https://stackoverflow.com/questions/33188413/python-code-to-convert-from-objectsid-to-sid-representation
 def sid_to_str(sid):
+	# binary SID -> S-1-5-21-..., None when it can't be decoded
 	try:
-		# Python 3
-		if str is not bytes:
-			# revision
-			revision = int(sid[0])
-			# count of sub authorities
-			sub_authorities = int(sid[1])
-			# big endian
-			identifier_authority = int.from_bytes(sid[2:8], byteorder='big')
-			# If true then it is represented in hex
-			if identifier_authority >= 2 ** 32:
-				identifier_authority = hex(identifier_authority)
-
-			# loop over the count of small endians
-			sub_authority = '-' + '-'.join([str(int.from_bytes(sid[8 + (i * 4): 12 + (i * 4)], byteorder='little')) for i in range(sub_authorities)])
-		# Python 2
-		else:
-			revision = int(b2a_hex(sid[0]))
-			sub_authorities = int(b2a_hex(sid[1]))
-			identifier_authority = int(b2a_hex(sid[2:8]), 16)
-			if identifier_authority >= 2 ** 32:
-				identifier_authority = hex(identifier_authority)
+		fields = sid_struct(sid[1]).unpack_from(sid)
+	except (IndexError, TypeError, struct.error):
+		return None
+	identifier_authority = int.from_bytes(fields[2], byteorder='big')
+	if identifier_authority >= 2 ** 32:
+		identifier_authority = hex(identifier_authority)
+	return "S-{}-{}-".format(fields[0], identifier_authority) + "-".join(map(str, fields[3:]))
+
+def sids_to_str(sids):
+	# decodes a batch of binary SIDs, interning the domain prefixes so SIDs
+	# of the same domain share them
+	decoded = []
+	for sid in sids:
+		s = sid_to_str(sid)
+		if (s is not None):
+			domain_sid(s)
+		decoded.append(s)
+	return decoded
+
+# https://docs.microsoft.com/en-us/openspecs/windows_protocols/ms-dtyp/2918391b-75b9-4eeb-83f0-7fdc04a5c6c9
+descriptor_header = struct.Struct("<BBHIIII")
+acl_header = struct.Struct("<BBHHH")
+ace_header = struct.Struct("<BBHI")
+ace_object_flags = struct.Struct("<I")
+
+access_mask = {
+	"GENERIC_ALL": 0x10000000,
+	"GENERIC_WRITE": 0x40000000,
+	"WRITE_OWNER": 0x00080000,
+	"WRITE_DACL": 0x00040000,
+	"DS_CONTROL_ACCESS": 0x00000100,
+	"DS_WRITE_PROP": 0x00000020,
+	"DS_SELF": 0x00000008,
+	"READ_CONTROL": 0x00020000,
+	"DS_GENERIC_ALL": 0x000F01FF
+}
 
-			sub_authority = '-' + '-'.join([str(int(b2a_hex(sid[11 + (i * 4): 7 + (i * 4): -1]), 16)) for i in range(sub_authorities)])
-		objectSid = 'S-' + str(revision) + '-' + str(identifier_authority) + sub_authority
+# object types the Aces of an object can be inherited for
+object_class_guids = {
+	"User": "bf967aba-0de6-11d0-a285-00aa003049e2",
+	"Computer": "bf967a86-0de6-11d0-a285-00aa003049e2",
+	"Group": "bf967a9c-0de6-11d0-a285-00aa003049e2",
+	"Domain": "19195a5a-6da0-11d0-afd3-00c04fd930c9"
+}
 
-		return objectSid
-	except Exception:
-		pass
+# extended rights and properties Bloodhound has edges for
+ace_guids = {
+	"00299570-246d-11d0-a768-00aa006e0529": "User-Force-Change-Password",
+	"1131f6aa-9c07-11d1-f79f-00c04fc2dcd2": "GetChanges",
+	"1131f6ad-9c07-11d1-f79f-00c04fc2dcd2": "GetChangesAll",
+	"bf9679c0-0de6-11d0-a285-00aa003049e2": "AddMember",
+	"3f78c3e5-f79a-46bd-a0b8-9d18116ddc79": "AddAllowedToAct"
+}
 
-def parse_domains(input_folder, output_folder, bh_version):
-	# https://github.com/dzhibas/SublimePrettyJson/blob/af5a6708d308f60787499e360081bf92afe66156/PrettyJson.py#L48
-	brace_newline = re.compile(r'^((\s*)".*?":)\s*([{])', re.MULTILINE)
-	bracket_newline = re.compile(r'^((\s*)".*?":)\s*([\[])', re.MULTILINE)
+# Creator Owner, Local System and Principal Self don't give anyone rights
+ignored_principals = set(["S-1-3-0", "S-1-5-18", "S-1-5-10"])
+
+# SID -> [SID, type] of the users, computers and groups of the dump, for the
+# PrincipalType of Aces
+principals = {}
+
+def has_descriptors(input_folder):
+	# whether the first object of any json input has an nTSecurityDescriptor
+	for name in ("domain_users", "domain_computers", "domain_groups", "domain_policy"):
+		path = input_file(input_folder, name)
+		if (path.endswith(".json") and os.path.exists(path)):
+			for obj in iter_json_array(path):
+				if ('nTSecurityDescriptor' in obj['attributes']):
+					return True
+				break
+	return False
 
-	count = 0
-	sid = None
-	j = json.loads(open(input_folder + ret_os_path() + "domain_policy.json", "r").read())
-	buf = '{"domains": ['
-	for dom in j:
-		d = Domain()
-		if 'objectSid' in dom['attributes'].keys():
-			d.ObjectIdentifier = dom['attributes']['objectSid'][0]
-			d.properties['objectid'] = dom['attributes']['objectSid'][0]
-		else:
-			d.ObjectIdentifier = None
-			d.properties['objectid'] = None
-
-#		if 'name' in dom['attributes'].keys():
-#			d.properties['name'] = dom['attributes']['name'][0].upper()
-#		else:
-#			d.properties['name'] = None
-
-		if 'cn' in dom['attributes'].keys():
-			d.properties['domain'] = dom['attributes']['cn'][0].upper()
-		elif 'distinguishedName' in dom['attributes'].keys():
-			d.properties['domain'] = dom['attributes']['distinguishedName'][0].upper().replace(",DC=", ".").replace("DC=", "")
-		else:
-			d.properties['domain'] = dom['attributes']['cn'][0].upper()
+def index_principals(input_folder):
+	# Users and computers are converted while they are being read, so the
+	# principals further on in the files, or in the files of the later
+	# stages, would not be known yet when their Aces are built. When the
+	# dump has descriptors, every input is read once up front for the types.
+	principals.clear()
+	read_principals(input_folder, principals)
+
+def read_principals(input_folder, found):
+	# adds the principals of one dump to found, which is returned
+	if (not has_descriptors(input_folder)):
+		return found
+	for name in ("domain_users", "domain_computers", "domain_groups"):
+		path = input_file(input_folder, name)
+		if (not os.path.exists(path)):
+			continue
+		for obj in read_records(path):
+			sid = obj['attributes']['objectSid'][0]
+			if (name == "domain_groups"):
+				found[sid] = [sid, "Group"]
+			elif ((name == "domain_computers") or ("$" in obj['attributes']['distinguishedName'][0])):
+				found[sid] = [sid, "Computer"]
+			else:
+				found[sid] = [sid, "User"]
+	return found
+
+def principal_type(sid):
+	entry = principals.get(sid)
+	if (entry is not None):
+		return entry[1]
+	# not in the dump: builtin and well known principals are groups, and so
+	# are most principals that get delegated rights
+	if (sid.startswith("S-1-5-21-") and (sid[sid.rfind("-") + 1:] in ("500", "501", "502", "503"))):
+		return "User"
+	return "Group"
+
+def descriptor_rights(mask, object_guid, object_type):
+	# the Bloodhound (RightName, AceType) pairs granted by one ACE
+	rights = []
+	generic = object_guid is None
+	if ((mask & access_mask["GENERIC_ALL"]) or (mask & access_mask["DS_GENERIC_ALL"]) == access_mask["DS_GENERIC_ALL"]):
+		if (generic):
+			rights.append(("GenericAll", ""))
+		return rights
+	if (mask & access_mask["WRITE_DACL"]):
+		rights.append(("WriteDacl", ""))
+	if (mask & access_mask["WRITE_OWNER"]):
+		rights.append(("WriteOwner", ""))
+	right = ace_guids.get(object_guid)
+	if (mask & access_mask["DS_CONTROL_ACCESS"]):
+		if ((object_type == "Domain") and (generic or right in ("GetChanges", "GetChangesAll"))):
+			rights.append(("ExtendedRight", "All" if generic else right))
+		elif ((object_type == "User") and (generic or right == "User-Force-Change-Password")):
+			rights.append(("ExtendedRight", "All" if generic else right))
+	if (object_type == "Domain"):
+		return rights
+	if (((mask & access_mask["GENERIC_WRITE"]) or (mask & access_mask["DS_WRITE_PROP"])) and generic):
+		rights.append(("GenericWrite", ""))
+	elif (mask & access_mask["DS_WRITE_PROP"]):
+		if ((object_type == "Group") and (right == "AddMember")):
+			rights.append(("WriteProperty", right))
+		elif ((object_type == "Computer") and (right == "AddAllowedToAct")):
+			rights.append(("WriteProperty", right))
+	return rights
+
+@functools.lru_cache(maxsize=4096)
+def parse_descriptor(encoded, object_type):
+	# base64 nTSecurityDescriptor -> (SID, right, ACE type, inherited). Most
+	# objects share one of a few descriptors, so each one is only decoded
+	# once per object type. The principal types are looked up per object by
+	# object_aces, as they depend on the rest of the dump.
+	try:
+		sd = base64.b64decode(encoded)
+		revision, sbz1, control, owner, group, sacl, dacl = descriptor_header.unpack_from(sd)
+		entries = []
+		sids = []
+		if (owner):
+			entries.append(("Owns", "", False))
+			sids.append(sd[owner:])
+		if (dacl):
+			ace_count = acl_header.unpack_from(sd, dacl)[3]
+			offset = dacl + acl_header.size
+			for _ in range(ace_count):
+				ace_type, flags, size, mask = ace_header.unpack_from(sd, offset)
+				start = offset + ace_header.size
+				offset += size
+				# allowed and allowed object ACEs that apply to this object
+				if ((ace_type not in (0, 5)) or (flags & 0x08)):
+					continue
+				object_guid = None
+				if (ace_type == 5):
+					object_flags = ace_object_flags.unpack_from(sd, start)[0]
+					start += ace_object_flags.size
+					if (object_flags & 1):
+						object_guid = str(uuid.UUID(bytes_le=sd[start:start + 16]))
+						start += 16
+					if (object_flags & 2):
+						if (str(uuid.UUID(bytes_le=sd[start:start + 16])) != object_class_guids[object_type]):
+							continue
+						start += 16
+				inherited = (flags & 0x10) != 0
+				for right, ace in descriptor_rights(mask, object_guid, object_type):
+					entries.append((right, ace, inherited))
+					sids.append(sd[start:offset])
+	except (struct.error, ValueError, TypeError):
+		return ()
+	aces = []
+	seen = set()
+	for sid, (right, ace, inherited) in zip(sids_to_str(sids), entries):
+		if ((sid is None) or (sid in ignored_principals) or ((sid, right, ace) in seen)):
+			continue
+		seen.add((sid, right, ace))
+		aces.append((sid, right, ace, inherited))
+	return tuple(aces)
+
+def object_aces(obj, object_type):
+	# the Aces of an object when the dump has its nTSecurityDescriptor
+	descriptor = obj['attributes'].get('nTSecurityDescriptor')
+	if (not descriptor):
+		return []
+	value = descriptor[0]
+	if (isinstance(value, dict)):
+		if ("base64" not in value.get('encoding', '').lower()):
+			return []
+		value = value['encoded']
+	return [{ "PrincipalSID": sid, "PrincipalType": principal_type(sid), "RightName": right, "AceType": ace, "IsInherited": inherited } for sid, right, ace, inherited in parse_descriptor(value, object_type)]
+
+@instrumented("domains", "domain_policy", "domain_trusts")
+def parse_domains(input_folder, output_folder, bh_version, trusts=False):
+	# with trusts the domain trusts are appended before domains.json is
+	# written, so it only has to be written once
+	domains = [d.to_dict() for d in convert_domains(input_file(input_folder, "domain_policy"))]
+	records = domains
+	if (trusts):
+		records = domains + [t.to_dict() for t in convert_trusts(input_file(input_folder, "domain_trusts"))]
+	with as_output(output_folder).writer("domains", bh_version) as outfile:
+		for dom in records:
+			outfile.write_dict(dom)
+	return domains
+
+def build_domain(dom):
+	d = Domain()
+	if 'objectSid' in dom['attributes'].keys():
+		d.ObjectIdentifier = dom['attributes']['objectSid'][0]
+		d.properties['objectid'] = dom['attributes']['objectSid'][0]
+	else:
+		d.ObjectIdentifier = None
+		d.properties['objectid'] = None
 
-		d.properties['name'] = d.properties['domain']
+#	if 'name' in dom['attributes'].keys():
+#		d.properties['name'] = dom['attributes']['name'][0].upper()
+#	else:
+#		d.properties['name'] = None
 
-		if 'distinguishedName' in dom['attributes'].keys():
-			d.properties['distinguishedname'] = dom['attributes']['distinguishedName'][0].upper()
-		elif 'dn' in dom.keys():
-			d.properties['distinguishedname'] = dom['dn'].upper()
-		else:
-			d.properties['distinguisedname'] = None
+	if 'cn' in dom['attributes'].keys():
+		d.properties['domain'] = dom['attributes']['cn'][0].upper()
+	elif 'distinguishedName' in dom['attributes'].keys():
+		d.properties['domain'] = dom['attributes']['distinguishedName'][0].upper().replace(",DC=", ".").replace("DC=", "")
+	else:
+		d.properties['domain'] = dom['attributes']['cn'][0].upper()
 
-		if 'description' in dom['attributes'].keys():
-			d.properties['description'] = dom['attributes']['description'][0]
-		else:
-			d.properties['description'] = None
+	d.properties['name'] = d.properties['domain']
 
-		if 'msDS-Behavior-Version' in dom['attributes'].keys():
-			d.properties['functionallevel'] = functional_level[int(dom['attributes']['msDS-Behavior-Version'][0])]
-		else:
-			d.properties['functionallevel'] = None
-		buf += d.export() + ', '
-		count += 1
+	if 'distinguishedName' in dom['attributes'].keys():
+		d.properties['distinguishedname'] = dom['attributes']['distinguishedName'][0].upper()
+	elif 'dn' in dom.keys():
+		d.properties['distinguishedname'] = dom['dn'].upper()
+	else:
+		d.properties['distinguisedname'] = None
 
-	with open(output_folder + ret_os_path() + "domains.json", "w") as outfile:
-		buf = bracket_newline.sub(r"\1\n\2\3", bracket_newline.sub(r"\1\n\2\3", json.dumps(json.loads(buf[:-2] + '],' + ' "meta": ' + '{' + '"type": "domains", "count": {}, "version": {}'.format(count, bh_version) + '}}'), indent=4, sort_keys=False, separators=(",", ": "))))
-		outfile.write(buf)
-	buf = ""
+	if 'description' in dom['attributes'].keys():
+		d.properties['description'] = dom['attributes']['description'][0]
+	else:
+		d.properties['description'] = None
 
+	if 'msDS-Behavior-Version' in dom['attributes'].keys():
+		d.properties['functionallevel'] = functional_level[int(dom['attributes']['msDS-Behavior-Version'][0])]
+	else:
+		d.properties['functionallevel'] = None
 
-def parse_domain_trusts(input_folder, output_folder, bh_version):
-	count = 0
-	sid = None
-	j = json.loads(open(input_folder + ret_os_path() + "domain_trusts.json", "r").read())
-	buf = '{"domains": ['
-	for dom in j:
-		d = Domain()
-		if ("base64".upper() in dom['attributes']['securityIdentifier'][0]['encoding'].upper()):
-			sid = sid_to_str(base64.b64decode(dom['attributes']['securityIdentifier'][0]['encoded']))
-			d.ObjectIdentifier = sid
-		else:
-			d.ObjectIdentifier = None
-		d.properties['name'] = dom['attributes']['name'][0].upper()
-		d.properties['domain'] = dom['attributes']['cn'][0].upper()
-		d.properties['objectid'] = sid
-		d.properties['distinguishedname'] = dom['attributes']['distinguishedName'][0].upper()
+	d.Aces = object_aces(dom, "Domain")
 
-		if 'description' in dom['attributes'].keys():
-			d.properties['description'] = dom['attributes']['description'][0]
-		else:
-			d.properties['description'] = None
+	domain_sids[d.properties['domain']] = d.ObjectIdentifier
+	return d
 
-		if 'msDS-Behavior-Version' in dom['attributes'].keys():
-			d.properties['functionallevel'] = functional_level[int(dom['attributes']['msDS-Behavior-Version'][0])]
-		else:
-			d.properties['functionallevel'] = None
+def build_trust(dom):
+	# a trusted domain, resolved against domain_sids
+	d = Domain()
+	sid = None
+	if ("base64".upper() in dom['attributes']['securityIdentifier'][0]['encoding'].upper()):
+		sid = sid_to_str(base64.b64decode(dom['attributes']['securityIdentifier'][0]['encoded']))
+		d.ObjectIdentifier = sid
+	else:
+		d.ObjectIdentifier = None
+	d.properties['name'] = dom['attributes']['name'][0].upper()
+	d.properties['domain'] = dom['attributes']['cn'][0].upper()
+	d.properties['objectid'] = sid
+	d.properties['distinguishedname'] = dom['attributes']['distinguishedName'][0].upper()
+
+	if 'description' in dom['attributes'].keys():
+		d.properties['description'] = dom['attributes']['description'][0]
+	else:
+		d.properties['description'] = None
 
-		target_domain_sid = None
-		already_found = json.loads(open(output_folder + ret_os_path() + "domains.json", "r").read())
-		for dom2 in already_found['domains']:
-			if (dom['attributes']['trustPartner'][0].upper() == dom2['Properties']['domain']):
-				target_domain_sid = dom2['ObjectIdentifier']
+	if 'msDS-Behavior-Version' in dom['attributes'].keys():
+		d.properties['functionallevel'] = functional_level[int(dom['attributes']['msDS-Behavior-Version'][0])]
+	else:
+		d.properties['functionallevel'] = None
 
-		sid_filtering = None
-		if (dom['attributes']['trustAttributes'][0] & trust_flags['QUARANTINED_DOMAIN']):
-			sid_filtering = True
-		else:
-			sid_filtering = False
-
-		transitive = False
-		if (dom['attributes']['trustAttributes'][0] & trust_flags['FOREST_TRANSITIVE']):
-			transitive = True
-			sid_filtering = True
-
-		if (target_domain_sid):
-			d.Trusts.append({
-					"TargetDomain": dom['attributes']['trustPartner'][0].upper(),
-					"TargetDomainSid": target_domain_sid,
-					"IsTransitive": transitive, 
-					"TrustDirection": int(dom['attributes']['trustDirection'][0]), 
-					"TrustType": int(dom['attributes']['trustType'][0]), 
-					"SidFilteringEnabled": sid_filtering
-			})
-
-		buf += d.export() + ', '
-		count += 1
-
-	j = json.loads(open(output_folder + ret_os_path() + "domains.json", "r").read())
-
-	if (count > 0):
-		new_domains = json.loads(buf[:-2] + "]}")
-		for dom in new_domains['domains']:
-			j['domains'].append(dom)
-		j['meta']['count'] += count
-		with open(output_folder + ret_os_path() + "domains.json", "w") as outfile:
-			outfile.write(json.dumps(j))
+	target_domain_sid = domain_sids.get(dom['attributes']['trustPartner'][0].upper())
+
+	sid_filtering = None
+	if (dom['attributes']['trustAttributes'][0] & trust_flags['QUARANTINED_DOMAIN']):
+		sid_filtering = True
 	else:
+		sid_filtering = False
+
+	transitive = False
+	if (dom['attributes']['trustAttributes'][0] & trust_flags['FOREST_TRANSITIVE']):
+		transitive = True
+		sid_filtering = True
+
+	if (target_domain_sid):
+		d.Trusts.append({
+				"TargetDomain": dom['attributes']['trustPartner'][0].upper(),
+				"TargetDomainSid": target_domain_sid,
+				"IsTransitive": transitive, 
+				"TrustDirection": int(dom['attributes']['trustDirection'][0]), 
+				"TrustType": int(dom['attributes']['trustType'][0]), 
+				"SidFilteringEnabled": sid_filtering
+		})
+
+	return d
+
+@instrumented("trusts", "domain_trusts")
+def parse_domain_trusts(input_folder, output_folder, bh_version, domains=None):
+	# domains are the records returned by parse_domains, the trusts get
+	# appended to them and domains.json is written out again
+	output = as_output(output_folder)
+	if (domains is None):
+		with open(output.path("domains.json"), "r") as infile:
+			domains = json_backend.loads(infile.read())['domains']
+		for dom in domains:
+			domain_sids[dom['Properties']['domain']] = dom['ObjectIdentifier']
+
+	trusts = [t.to_dict() for t in convert_trusts(input_file(input_folder, "domain_trusts"))]
+	if (len(trusts) == 0):
 		# we have no domain trusts, stop doing anything
 		return
 
+	with output.writer("domains", bh_version) as outfile:
+		for dom in domains + trusts:
+			outfile.write_dict(dom)
+
+def convert_users(records):
+	# Library entry points: records is anything read_records() takes and the
+	# Bloodhound objects are yielded one at a time, without touching the disk
+	# unless records is a path. Users and computers have to be converted
+	# before the groups they are members of, as members are resolved through
+	# db. Write the objects with a BloodHoundWriter on any open file.
+	new_primary("users")
+	for user in read_records(records):
+		index_user(user)
+		yield build_user(user)
+
+def convert_computers(records):
+	new_primary("computers")
+	for comp in read_records(records):
+		index_computer(comp)
+		yield build_computer(comp)
+
+def convert_groups(records):
+	# groups can be members of each other, so every group DN goes into db
+	# before the first group is built. Paths, seekable file objects and
+	# sequences are read twice, other iterables are kept in memory.
+	if hasattr(records, "read"):
+		start = records.tell()
+		index_groups(read_records(records))
+		records.seek(start)
+	elif (iter(records) is records):
+		records = list(records)
+		index_groups(records)
+	else:
+		index_groups(read_records(records))
+	for group in read_records(records):
+		yield build_group(group)
+
+def convert_domains(records):
+	# also fills domain_sids, convert these before the trusts
+	for dom in read_records(records):
+		yield build_domain(dom)
+
+def convert_trusts(records):
+	for dom in read_records(records):
+		yield build_trust(dom)
+
+def run_stage(stage, input_folder, output_folder, bh_version, dn_index=None, index=False, incremental=False, nested=False, settings=(False, None, "."), domain_map=None, primary=None, principal_index=None):
+	# Entry point for a worker process. db and primary_members are reset to
+	# the indexes handed over by the parent so the group stage can resolve
+	# members without rereading domain_users.json, and the users and
+	# computers stages send theirs back along with the stats. domain_map
+	# adds other domains for resolving trusts, principal_index is the
+	# principals of the dump for the Aces.
+	db.clear()
+	domain_sids.clear()
+	primary_members.clear()
+	principals.clear()
+	stats.configure(settings)
+	if (principal_index is not None):
+		principals.update(principal_index)
+	if (dn_index is not None):
+		db.update(dn_index)
+	if (domain_map is not None):
+		domain_sids.update(domain_map)
+	if (primary is not None):
+		primary_members.update(primary)
+	if (stage == "users"):
+		parse_users(input_folder, output_folder, bh_version, index, incremental)
+		as_output(output_folder).close()
+		return db, primary_members, stats.stages
+	elif (stage == "computers"):
+		parse_computers(input_folder, output_folder, bh_version, incremental, index)
+		as_output(output_folder).close()
+		return None, primary_members, stats.stages
+	elif (stage == "groups"):
+		parse_groups(input_folder, output_folder, dn_index is None, bh_version, index, incremental, nested)
+	elif (stage == "domains"):
+		parse_domains(input_folder, output_folder, bh_version, trusts=True)
+	as_output(output_folder).close()
+	return None, None, stats.stages
+
+def run_chunk(stage, path, start, end, part_path, bh_version, output, settings=(False, None, "."), principal_index=None):
+	# Converts one byte range of domain_users.json or domain_computers.json
+	# into a fragment file, or into shards of their own when sharding.
+	# Returns the object count, the DN index and primary group entries, the
+	# shard files and the stats.
+	db.clear()
+	primary_members.clear()
+	principals.clear()
+	new_primary(stage)
+	stats.configure(settings)
+	if (principal_index is not None):
+		principals.update(principal_index)
+	build = build_user if stage == "users" else build_computer
+	index = index_user if stage == "users" else index_computer
+	with stats.stage(os.path.basename(part_path), [], end - start):
+		if (output.shard_size > 0):
+			outfile = output.writer(stage, bh_version, os.path.basename(part_path))
+		else:
+			outfile = stats.writer(BloodHoundWriter(open(part_path, "w"), stage, bh_version, fragment=True, compact=output.compact, owns_file=True))
+		with outfile:
+			for obj in stats.reading(iter_json_array(path, start, end)):
+				index(obj)
+				outfile.write(build(obj))
+	if (output.shard_size > 0):
+		return outfile.count, db, primary_members, list(zip(outfile.files, outfile.counts)), stats.stages
+	return outfile.count, db, primary_members, None, stats.stages
+
+def join_chunks(stage, input_folder, output, bh_version, parts, index=False):
+	# parts are (fragment path, future) pairs in input file order, their
+	# primary group entries go into primary_members
+	dn_index = {}
+	new_primary(stage)
+	with stats.stage(stage + ".join", []), output.writer(stage, bh_version) as outfile:
+		for part_path, future in parts:
+			count, entries, primary, shards, worker_stages = future.result()
+			merge_primary(primary)
+			stats.stages.extend(worker_stages)
+			if (shards is None):
+				outfile.append_fragment(part_path, count)
+				os.remove(part_path)
+			else:
+				for shard_path, shard_count in shards:
+					if (shard_count > 0):
+						outfile.adopt(shard_path, shard_count)
+					else:
+						os.remove(shard_path)
+			dn_index.update(entries)
+	if (index):
+		save_user_index(output.folder, input_file(input_folder, "domain_" + stage), dn_index if stage == "users" else {}, stage)
+	return dn_index
+
+def run_parallel(input_folder, output_folder, bh_version, stages, jobs, chunk_size=0, index=False, incremental=False, nested=False):
+	# users, computers and domains don't depend on each other, groups need
+	# the DN index built by the users stage and the primary group members
+	# of the users and computers stages. Users and computers files
+	# bigger than chunk_size bytes are split up and converted by several
+	# workers, except in incremental mode where most objects come from the
+	# state file anyway, for neo4j CSV which has no fragments to join, and
+	# for .grep input which is cheap to read.
+	output = as_output(output_folder)
+	index_principals(input_folder)
+	with concurrent.futures.ProcessPoolExecutor(max_workers=jobs, initializer=use_json_backend, initargs=(json_backend.name,)) as pool:
+		futures = {}
+		chunked = {}
+		for stage in ("users", "computers", "domains"):
+			if (stage not in stages):
+				continue
+			print("Parsing {}...".format(stage))
+			path = input_file(input_folder, "domain_" + stage)
+			if ((stage != "domains") and (chunk_size > 0) and not incremental and not output.neo4j and path.endswith(".json")):
+				chunks = find_chunks(path, -(-os.path.getsize(path) // chunk_size))
+				if (len(chunks) > 1):
+					chunked[stage] = []
+					for i, (start, end) in enumerate(chunks):
+						part_path = output.path("{}.json.part{}".format(stage, i))
+						chunked[stage].append((part_path, pool.submit(run_chunk, stage, path, start, end, part_path, bh_version, output.spool(), stats.settings(), principals)))
+					continue
+			futures[stage] = pool.submit(run_stage, stage, input_folder, output.part(stage), bh_version, None, index, incremental, False, stats.settings(), None, None, principals)
+		if ("groups" in stages):
+			dn_index = None
+			for stage in ("users", "computers"):
+				if (stage in chunked):
+					entries = join_chunks(stage, input_folder, output, bh_version, chunked.pop(stage), index)
+				elif (stage in futures):
+					entries, primary, worker_stages = futures[stage].result()
+					merge_primary(primary)
+				else:
+					continue
+				if (stage == "users"):
+					dn_index = entries
+			if (dn_index is not None):
+				db.update(dn_index)
+			print("Parsing groups...")
+			futures["groups"] = pool.submit(run_stage, "groups", input_folder, output.part("groups"), bh_version, dn_index, index, incremental, nested, stats.settings(), None, primary_members, principals)
+		for stage, parts in chunked.items():
+			db.update(join_chunks(stage, input_folder, output, bh_version, parts, index))
+		for stage, future in futures.items():
+			stats.stages.extend(future.result()[2])
+			output.merge_part(output.part(stage))
+	output.close()
+
+def find_dumps(input_folder):
+	# the ldapdomaindump folders directly under input_folder, one per domain
+	dumps = []
+	for name in sorted(os.listdir(input_folder)):
+		path = input_folder + ret_os_path() + name
+		if (os.path.isdir(path) and os.path.exists(input_file(path, "domain_policy"))):
+			dumps.append(name)
+	return dumps
+
+def foreign_sid(dn):
+	# members from another domain are CN=<SID>,CN=ForeignSecurityPrincipals,...
+	if (dn.startswith("CN=S-") and ",CN=ForeignSecurityPrincipals," in dn):
+		return dn[3:dn.index(",")]
+	return None
+
+def index_dump(input_folder, output_folder, users, index=False):
+	# Batch worker: the group DNs, the domain SID and the foreign security
+	# principals referenced by the groups of one dump, plus the users and
+	# their primary groups when the users stage doesn't run and build those
+	# entries itself.
+	db.clear()
+	domain_sids.clear()
+	primary_members.clear()
+	if (users):
+		load_user_index(input_folder, output_folder, index)
+	foreign = set()
+	for group in read_records(input_file(input_folder, "domain_groups")):
+		db[group['attributes']['distinguishedName'][0]] = [group['attributes']['objectSid'][0], "Group"]
+		for m in group['attributes'].get('member', []):
+			if (foreign_sid(m) is not None):
+				foreign.add(m)
+	for _ in convert_domains(input_file(input_folder, "domain_policy")):
+		pass
+	return db, domain_sids, primary_members, foreign
+
+def run_batch(input_folder, output_folder, bh_version, stages, jobs, index=False, incremental=False, nested=False):
+	# Converts every dump folder under input_folder into a folder of the same
+	# name under output_folder, several domains at a time. Users, computers
+	# and the indexes of all domains are done first, so that the groups and
+	# trusts of every domain are resolved against one DN index and one
+	# domain map, including members from other domains that only show up as
+	# foreign security principals.
+	output = as_output(output_folder)
+	dumps = find_dumps(input_folder)
+	outputs = {}
+	for name in dumps:
+		os.makedirs(output.path(name), exist_ok=True)
+		outputs[name] = Output(output.path(name), output.compression, output.compact, shard_size=output.shard_size, neo4j=output.neo4j)
+	def dump(name):
+		return input_folder + ret_os_path() + name
+
+	dn_index = {}
+	foreign = set()
+	with concurrent.futures.ProcessPoolExecutor(max_workers=jobs, initializer=use_json_backend, initargs=(json_backend.name,)) as pool:
+		# principals of every domain, so Aces granted across domains resolve
+		principals.clear()
+		for future in [pool.submit(read_principals, dump(name), {}) for name in dumps]:
+			principals.update(future.result())
+		first = []
+		for name in dumps:
+			print("Parsing {}...".format(name))
+			for stage in ("users", "computers"):
+				if (stage in stages):
+					first.append((name, stage, pool.submit(run_stage, stage, dump(name), outputs[name].part(stage), bh_version, None, index, incremental, False, stats.settings(), None, None, principals)))
+		indexes = [pool.submit(index_dump, dump(name), outputs[name].folder, "users" not in stages, index) for name in dumps]
+		primary_members.clear()
+		for future in indexes:
+			entries, sids, primary, refs = future.result()
+			dn_index.update(entries)
+			domain_sids.update(sids)
+			merge_primary(primary)
+			foreign |= refs
+		for name, stage, future in first:
+			entries, primary, worker_stages = future.result()
+			stats.stages.extend(worker_stages)
+			merge_primary(primary)
+			if (entries is not None):
+				dn_index.update(entries)
+
+		# foreign security principals that are a user, computer or group in
+		# one of the other dumps
+		wanted = {}
+		for dn in foreign:
+			wanted.setdefault(foreign_sid(dn), []).append(dn)
+		resolved = {}
+		for sid, member_type in dn_index.values():
+			for dn in wanted.pop(sid, []):
+				resolved[dn] = [sid, member_type]
+		dn_index.update(resolved)
+
+		second = []
+		for name in dumps:
+			if ("groups" in stages):
+				second.append((name, "groups", pool.submit(run_stage, "groups", dump(name), outputs[name].part("groups"), bh_version, dn_index, index, incremental, nested, stats.settings(), None, primary_members, principals)))
+			if ("domains" in stages):
+				second.append((name, "domains", pool.submit(run_stage, "domains", dump(name), outputs[name].part("domains"), bh_version, None, index, incremental, False, stats.settings(), dict(domain_sids), None, principals)))
+		for name, stage, future in second:
+			stats.stages.extend(future.result()[2])
+		for name, stage, future in first + second:
+			outputs[name].merge_part(outputs[name].part(stage))
+	for name in dumps:
+		outputs[name].close()
+	db.update(dn_index)
+
+# the ldapdomaindump files each stage reads, groups also need the users for
+# resolving members
+watch_inputs = {
+	"users": ["domain_users"],
+	"computers": ["domain_computers"],
+	# the primaryGroupID members of groups come from the users and computers
+	"groups": ["domain_groups", "domain_users", "domain_computers"],
+	"domains": ["domain_policy", "domain_trusts"]
+}
+
+def file_state(path):
+	try:
+		st = os.stat(path)
+	except OSError:
+		return None
+	return (st.st_size, st.st_mtime_ns)
+
+def watch_files(input_folder, stage):
+	names = watch_inputs[stage]
+	if (any(input_file(input_folder, name).endswith(".grep") for name in names)):
+		# rows of .grep files also depend on the files GrepDump.load reads
+		names = names + ["domain_policy", "domain_groups", "domain_users"]
+	return names
+
+def watch_state(input_folder, stages):
+	return { stage: [file_state(input_file(input_folder, name)) for name in watch_files(input_folder, stage)] for stage in stages }
+
+def watch(input_folder, output_folder, bh_version, stages, interval, index=False, incremental=False, nested=False):
+	# Keeps converting the stages whose input files changed, polling their
+	# size and mtime every interval seconds. db and domain_sids stay in
+	# memory between conversions, so a new domain_groups.json is converted
+	# without reading the users again. Runs until interrupted.
+	output = as_output(output_folder)
+	# where the state of domain_users is in current["groups"]
+	users_at = watch_inputs["groups"].index("domain_users")
+	users_state = None
+	converted = {}
+	current = watch_state(input_folder, stages)
+	while True:
+		changed = [stage for stage in stages if current[stage] != converted.get(stage)]
+		if (changed):
+			print("Converting {}...".format(", ".join(changed)))
+			try:
+				if (set(changed) & set(["users", "computers", "groups"])):
+					index_principals(input_folder)
+				if ("users" in changed):
+					db.clear()
+					parse_users(input_folder, output, bh_version, index, incremental)
+					users_state = current["users"][watch_inputs["users"].index("domain_users")]
+				if ("computers" in changed):
+					parse_computers(input_folder, output, bh_version, incremental, index)
+				if ("groups" in changed):
+					if ("computers" not in stages):
+						# reread by parse_groups, nothing keeps them current
+						primary_members.pop("computers", None)
+					if (users_state != current["groups"][users_at]):
+						# the users stage isn't watched, or hasn't run yet
+						db.clear()
+						load_user_index(input_folder, output.folder, index)
+						users_state = current["groups"][users_at]
+					else:
+						# groups that were removed from the dump must not
+						# resolve as members any more
+						for dn in [dn for dn, entry in db.items() if entry[1] == "Group"]:
+							del db[dn]
+					parse_groups(input_folder, output, False, bh_version, index, incremental, nested)
+				if ("domains" in changed):
+					domain_sids.clear()
+					parse_domains(input_folder, output, bh_version, trusts=True)
+			except (OSError, ValueError, KeyError) as e:
+				# most likely a dump that is still being written, it is
+				# converted again when it changes
+				print("Conversion failed: {}".format(e))
+			output.close()
+			for stage in changed:
+				converted[stage] = current[stage]
+			if (stats.enabled):
+				stats.summary()
+				stats.stages = []
+			print("Done, watching {} for changes...".format(input_folder))
+		time.sleep(interval)
+		previous, current = current, watch_state(input_folder, stages)
+		while (current != previous):
+			# still being written, wait until it settles
+			time.sleep(interval)
+			previous, current = current, watch_state(input_folder, stages)
+
 if __name__ == '__main__':
 	parser = argparse.ArgumentParser(
 			formatter_class=argparse.RawDescriptionHelpFormatter,
@@ -700,31 +3042,85 @@ if __name__ == '__main__':
 	parser.add_argument('-g','--groups', action='store_true', default=False, required=False, help='Output only groups, default: False')
 	parser.add_argument('-d','--domains', action='store_true', default=False, required=False, help='Output only domains, default: False')
 	parser.add_argument('-b','--bh-version', dest='bh_version', default=3, type=int, required=False, help='Bloodhound data format version (only 3 for now), default: 3')
+	parser.add_argument('-j','--jobs', dest='jobs', default=1, type=int, required=False, help='Convert object types in parallel using this many processes, default: 1')
+	parser.add_argument('--index', action='store_true', default=False, required=False, help='Keep the DN to SID index in ldd2bh_cache.db next to the output and reuse it on later runs, default: False')
+	parser.add_argument('--incremental', action='store_true', default=False, required=False, help='Only convert objects that changed since the last run into this output folder, default: False')
+	parser.add_argument('--nested', action='store_true', default=False, required=False, help='Also write memberships.json with the effective (nested) group memberships of every member, next to the Bloodhound files or archive, default: False')
+	compression = parser.add_mutually_exclusive_group()
+	compression.add_argument('--zip', dest='compression', action='store_const', const='zip', help='Write all Bloodhound files into bloodhound.zip in the output directory')
+	compression.add_argument('--gzip', dest='compression', action='store_const', const='gzip', help='Gzip each Bloodhound file (users.json.gz, ...)')
+	parser.add_argument('--compact', action='store_true', default=False, required=False, help='Write json without indentation, default: False')
+	parser.add_argument('--neo4j', action='store_true', default=False, required=False, help='Write node and relationship CSV files for neo4j-admin import instead of Bloodhound json, default: False')
+	parser.add_argument('--shard-size', dest='shard_size', default=0, type=int, required=False, help='Split every file into users_0001.json, users_0002.json, ... of at most this many objects, replacing the shards of an earlier run, 0 disables, default: 0')
+	parser.add_argument('--stats', action='store_true', default=False, required=False, help='Print time, objects/s, bytes read and written and peak memory for every stage, default: False')
+	parser.add_argument('--stats-file', dest='stats_file', default=None, required=False, help='Also write the stage stats as json to this file')
+	parser.add_argument('--json-backend', dest='json_backend', default=None, choices=list(json_backends), required=False, help='JSON library to read and write with, the output is the same with each, default: the fastest one installed')
+	parser.add_argument('--profile', dest='profile', default=None, choices=["users", "computers", "groups", "domains"], required=False, help='Run this stage under cProfile and write ldd2bh_STAGE.prof to the output directory')
+	parser.add_argument('--max-memory', dest='max_memory', metavar='MB', default=0, type=int, required=False, help='Keep about this many MB of the DN to SID and primary group indexes in memory and move the rest to ldd2bh_cache.db in the output directory, 0 disables, default: 0')
+	parser.add_argument('--batch', action='store_true', default=False, required=False, help='The input directory holds one ldapdomaindump directory per domain, convert them all into directories of the same name with shared indexes, default: False')
+	parser.add_argument('--watch', dest='watch', default=None, type=float, metavar='SECONDS', required=False, help='Keep running and convert again whenever the input files change, checking every SECONDS')
+	parser.add_argument('--chunk-size', dest='chunk_size', default=64, type=int, required=False, help='With --jobs, split users and computers files into chunks of about this many MB, 0 disables, default: 64')
 
 	args = parser.parse_args()
 	
 	if ((args.bh_version != 3)):
 		raise argparse.ArgumentTypeError('Invalid Bloodhound file version given! New version support might come in the future.')
 
+	if (args.neo4j and (args.compression == "zip" or args.shard_size > 0)):
+		parser.error('--neo4j writes two CSV files per object type and can\'t be combined with --zip or --shard-size')
+
+	if (args.watch is not None and args.batch):
+		parser.error('--watch and --batch can\'t be combined')
+
+	if (args.watch is not None and (args.compression == "zip" or args.jobs > 1)):
+		parser.error('--watch only converts what changed, which can\'t be done with --zip or --jobs')
+
+	if (args.max_memory > 0 and (args.jobs > 1 or args.batch)):
+		parser.error('--max-memory bounds a single process, it can\'t be combined with --jobs or --batch')
+
 	if ((args.input_folder != ".") and (args.output_folder != ".")):
 		if (sum([args.users, args.computers, args.groups, args.domains]) == 0):
 			args.users = True
 			args.computers = True
 			args.groups = True
 			args.domains = True
-		if (args.users):
-			print("Parsing users...")
-			parse_users(args.input_folder, args.output_folder, args.bh_version)
-		if (args.computers):
-			print("Parsing computers...")
-			parse_computers(args.input_folder, args.output_folder, args.bh_version)
-		if (args.groups):
-			print("Parsing groups...")
-			parse_groups(args.input_folder, args.output_folder, not args.users, args.bh_version)
-		if (args.domains):
-			print("Parsing domains...")
-			parse_domains(args.input_folder, args.output_folder, args.bh_version)
-			parse_domain_trusts(args.input_folder, args.output_folder, args.bh_version)
+		output = Output(args.output_folder, args.compression, args.compact, shard_size=args.shard_size, neo4j=args.neo4j)
+		if (args.json_backend):
+			use_json_backend(args.json_backend)
+		stats.configure((args.stats or args.stats_file is not None, args.profile, args.output_folder))
+		stages = [stage for stage in ("users", "computers", "groups", "domains") if getattr(args, stage)]
+		if (args.max_memory > 0):
+			limit_memory(args.output_folder, args.max_memory)
+		if (args.batch):
+			run_batch(args.input_folder, output, args.bh_version, stages, args.jobs, args.index, args.incremental, args.nested)
+		elif (args.watch is not None):
+			try:
+				watch(args.input_folder, output, args.bh_version, stages, args.watch, args.index, args.incremental, args.nested)
+			except KeyboardInterrupt:
+				output.close()
+		elif (args.jobs > 1):
+			run_parallel(args.input_folder, output, args.bh_version, stages, args.jobs, args.chunk_size * 1024 * 1024, args.index, args.incremental, args.nested)
+		else:
+			index_principals(args.input_folder)
+			if (args.users):
+				print("Parsing users...")
+				parse_users(args.input_folder, output, args.bh_version, args.index, args.incremental)
+			if (args.computers):
+				print("Parsing computers...")
+				parse_computers(args.input_folder, output, args.bh_version, args.incremental, args.index)
+			if (args.groups):
+				print("Parsing groups...")
+				parse_groups(args.input_folder, output, not args.users, args.bh_version, args.index, args.incremental, args.nested)
+			if (args.domains):
+				print("Parsing domains...")
+				parse_domains(args.input_folder, output, args.bh_version, trusts=True)
+			output.close()
+		if (spill is not None):
+			spill.close()
+		if (args.stats):
+			stats.summary()
+		if (args.stats_file is not None):
+			stats.save(args.stats_file)
 		print("Done!")
 	else:
 		parser.print_help()